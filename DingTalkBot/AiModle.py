@@ -1,16 +1,275 @@
 from g4f.client import Client
 from g4f import Provider
+import asyncio
 import json
+import re
+import threading
 from sparkai.llm.llm import ChatSparkLLM, ChunkPrintHandler
 from sparkai.core.messages import ChatMessage
+from .AnswerCache import get_answer_cache
+from .Context import fit_context
+from .SingleFlight import Abandoned, get_single_flight
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+# 星火各模型对应的(URL, domain)
+SPARK_MODELS = {
+    "sparkUltra": ("wss://spark-api.xf-yun.com/v4.0/chat", "4.0Ultra"),
+    "sparkMax": ("wss://spark-api.xf-yun.com/v3.5/chat", "generalv3.5"),
+    "sparkPro": ("wss://spark-api.xf-yun.com/v3.1/chat", "generalv3"),
+    "sparkV2": ("wss://spark-api.xf-yun.com/v2.1/chat", "generalv2"),
+    "sparkLite": ("wss://spark-api.xf-yun.com/v1.1/chat", "general"),
+}
+
+# 各模型(g4f模型名或星火domain)可用于对话记录的token预算，已为问题和回答留出余量；
+# token数为估算值，见Context.count_tokens
+CONTEXT_BUDGETS = {
+    "gpt-3.5-turbo": 3000,
+    "4.0Ultra": 6000,
+    "generalv3.5": 6000,
+    "generalv3": 6000,
+    "generalv2": 6000,
+    "general": 2000,
+}
+
+
+def context_budget(model: str) -> int:
+    """
+    模型可用于对话记录的token预算，未知模型按最小预算处理。
+    param model: g4f模型名或星火domain，如"general"(Spark Lite)、"4.0Ultra"
+    """
+    return CONTEXT_BUDGETS.get(model, min(CONTEXT_BUDGETS.values()))
+
+
+# Blackbox在回复开头附带的"$@$...$@$"标记
+_G4F_PREFIX = re.compile(r"^\$@\$.*?\$@\$", re.S)
+
+
+def _answer(model: str, msg: str, context: list, call) -> str:
+    """
+    问答外加回答缓存和请求合并：命中缓存时直接返回；相同的请求进行中时等待其结果；
+    否则调用大模型，由这一个请求写入缓存。
+    param call: 调用大模型的无参函数
+    """
+    cache = get_answer_cache()
+    if cache is not None:
+        answer = cache.get(model, msg, context)
+        if answer is not None:
+            return answer
+
+    def fetch():
+        answer = call()
+        if cache is not None:
+            cache.put(model, msg, context, answer)
+        return answer
+
+    flight = get_single_flight()
+    if flight is None:
+        return fetch()
+    return flight.do(model, msg, context, fetch)
+
+
+async def _answer_stream(model: str, msg: str, context: list, stream):
+    """
+    流式问答外加回答缓存和请求合并：命中缓存或有相同的请求进行中时，一次性返回完整的回答；
+    否则逐段转发stream，结束后通知等待的请求并缓存完整回答。
+    缓存的查询和写入可能读写磁盘、计算向量相似度，放到线程池中执行，不阻塞事件循环。
+    param stream: 实际调用大模型的异步生成器
+    """
+    loop = asyncio.get_running_loop()
+    cache = get_answer_cache()
+    if cache is not None:
+        answer = await loop.run_in_executor(None, cache.get, model, msg, context)
+        if answer is not None:
+            await stream.aclose()
+            yield answer
+            return
+    flight = get_single_flight()
+    leader = False
+    if flight is not None:
+        key, future, leader = flight.join(model, msg, context)
+        if not leader:
+            try:
+                # shield避免本请求被取消时连带取消其他请求共享的Future
+                answer = await asyncio.shield(asyncio.wrap_future(future))
+            except Abandoned:
+                # 首个请求中途放弃，自己调用
+                answer = None
+            if answer is not None:
+                await stream.aclose()
+                yield answer
+                return
+    parts = []
+    try:
+        async for token in stream:
+            parts.append(token)
+            yield token
+    except BaseException as e:
+        if leader:
+            flight.finish(key, future, error=e)
+        raise
+    answer = "".join(parts)
+    if leader:
+        flight.finish(key, future, answer)
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, model, msg, context, answer)
+
+
+async def _stream_in_thread(produce):
+    """
+    在线程中运行阻塞的流式调用，把产生的token逐个送回事件循环。
+    param produce: 形如produce(emit)的函数，每得到一段文本就调用emit(text)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def emit(token):
+        loop.call_soon_threadsafe(queue.put_nowait, token)
+
+    def run():
+        try:
+            produce(emit)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    future = loop.run_in_executor(None, run)
+    while True:
+        item = await queue.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    await future
+
+
+class _TokenHandler(ChunkPrintHandler):
+    """
+    把星火流式返回的token转交给emit。
+    """
+
+    def __init__(self, emit):
+        super().__init__()
+        self.emit = emit
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self.emit(token)
+
+# 连接断开、超时等说明客户端连接可能已损坏的错误，换新客户端(重连)后重试可能成功；
+# 鉴权失败、内容审核、参数错误、解析错误等其余错误重试也不会成功，直接抛出。
+# 星火通过websocket-client连接，requests、aiohttp的连接错误和超时都是OSError的子类
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError)
+if websocket is not None:
+    TRANSIENT_ERRORS += (
+        websocket.WebSocketConnectionClosedException,
+        websocket.WebSocketTimeoutException,
+        websocket.WebSocketAddressException,
+    )
+
+
+class ClientPool:
+    """
+    复用大模型客户端。
+    客户端内部保存了单次会话的状态，不能并发使用，因此同一时刻只借给一个调用者，用完归还；
+    出现连接或超时错误的客户端视为连接已损坏，直接丢弃，重新创建一个(即重连)后重试，
+    其余错误与客户端无关，归还客户端后直接抛出，不重试。
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_idle: int = 8,
+        unhealthy_after: int = 3,
+        transient: tuple = TRANSIENT_ERRORS,
+    ):
+        """
+        初始化。
+        param factory: 创建客户端的无参函数
+        param max_idle: 最多保留的空闲客户端数
+        param unhealthy_after: 连续失败多少次后health_check报告不健康
+        param transient: 需要丢弃客户端并重试的异常类型
+        """
+        self.factory = factory
+        self.max_idle = max_idle
+        self.unhealthy_after = unhealthy_after
+        self.transient = transient
+        self.created = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        return self.factory()
+
+    def _checkin(self, client):
+        with self._lock:
+            self.consecutive_failures = 0
+            if len(self._idle) < self.max_idle:
+                self._idle.append(client)
+
+    def call(self, func, retries: int = 1):
+        """
+        借出一个客户端执行func(client)，连接或超时错误时丢弃该客户端并换新的重试，其余错误直接抛出。
+        param func: 使用客户端的函数
+        param retries: 失败后的重试次数，流式调用已经输出了内容时不应重试，应传0
+        """
+        for attempt in range(retries + 1):
+            client = self._checkout()
+            try:
+                result = func(client)
+            except self.transient:
+                with self._lock:
+                    self.failures += 1
+                    self.consecutive_failures += 1
+                if attempt == retries:
+                    raise
+                continue
+            except Exception:
+                self._checkin(client)
+                raise
+            self._checkin(client)
+            return result
+
+    def health_check(self) -> dict:
+        """
+        返回客户端池的状态。
+        """
+        with self._lock:
+            return {
+                "healthy": self.consecutive_failures < self.unhealthy_after,
+                "idle": len(self._idle),
+                "created": self.created,
+                "failures": self.failures,
+            }
+
+    def reset(self):
+        """
+        丢弃所有空闲客户端，下次调用时重新创建。
+        """
+        with self._lock:
+            self._idle = []
 
 
 class GPT4Free:
 
+    model = "gpt-3.5-turbo"
+
     def __init__(self):
         """
         初始化g4f_ai
         """
+        self.pool = ClientPool(lambda: Client(provider=Provider.Blackbox))
 
     def ask(self, msg: str, context: list = []) -> str:
         """
@@ -19,20 +278,72 @@ class GPT4Free:
         param context: 上下文，格式为[[用户问题1,机器人回答1],[用户问题2,机器人回答2],...]
         return: AI的回答
         """
-        client = Client(provider=Provider.Blackbox)
+        context = fit_context(context, context_budget(self.model))
+        return _answer(self.model, msg, context, lambda: self._ask(msg, context))
+
+    def _ask(self, msg: str, context: list) -> str:
+        messages = self._messages(msg, context)
+        response = self.pool.call(
+            lambda client: client.chat.completions.create(
+                model=self.model, messages=messages
+            )
+        )
+        rt_text = response.choices[0].message.content
+        # 只去掉开头的标记，与流式输出一致，回答正文中的"$"保持原样
+        return _G4F_PREFIX.sub("", rt_text, count=1)
+
+    def _messages(self, msg: str, context: list) -> list:
         messages = []
         messages.append({"role": "system", "content": "你是一个中文问答助手，无特殊情况不要用英语回复"})
         for thismsg in context:
             messages.append({"role": "user", "content": thismsg[0]})
             messages.append({"role": "assistant", "content": thismsg[1]})
         messages.append({"role": "user", "content": msg})
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo", messages=messages
-        )
-        rt_text = response.choices[0].message.content
-        last_dollar_index = rt_text.rfind("$")
-        result = rt_text[last_dollar_index + 1 :]
-        return result
+        return messages
+
+    async def ask_stream(self, msg: str, context: list = []):
+        """
+        流式问答，以异步生成器逐段返回AI的回答
+        param msg: 用户输入的问题
+        param context: 上下文，格式同ask
+        """
+        context = fit_context(context, context_budget(self.model))
+        async for token in _answer_stream(
+            self.model, msg, context, self._ask_stream(msg, context)
+        ):
+            yield token
+
+    async def _ask_stream(self, msg: str, context: list):
+        messages = self._messages(msg, context)
+
+        def generate(client, emit):
+            response = client.chat.completions.create(
+                model=self.model, messages=messages, stream=True
+            )
+            for chunk in response:
+                content = chunk.choices[0].delta.content
+                if content:
+                    emit(content)
+
+        def produce(emit):
+            self.pool.call(lambda client: generate(client, emit), retries=0)
+
+        # 开头的"$@$...$@$"标记需要攒齐后整体去掉
+        head = ""
+        async for token in _stream_in_thread(produce):
+            if head is None:
+                yield token
+                continue
+            head += token
+            if head.startswith("$") and not _G4F_PREFIX.match(head):
+                if len(head) < 256:
+                    continue
+            text = _G4F_PREFIX.sub("", head, count=1)
+            head = None
+            if text:
+                yield text
+        if head:
+            yield _G4F_PREFIX.sub("", head, count=1)
 
 
 class SparkAI:
@@ -50,75 +361,132 @@ class SparkAI:
         self.app_id = spark_app_id
         self.api_key = spark_api_key
         self.api_secret = spark_api_secret
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def _pool(self, api_url: str, llm_domain: str, streaming: bool) -> ClientPool:
+        """
+        每种模型配置一个客户端池，首次使用时创建。
+        """
+        key = (api_url, llm_domain, streaming)
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = ClientPool(
+                    lambda: ChatSparkLLM(
+                        spark_api_url=api_url,
+                        spark_app_id=self.app_id,
+                        spark_api_key=self.api_key,
+                        spark_api_secret=self.api_secret,
+                        spark_llm_domain=llm_domain,
+                        streaming=streaming,
+                        max_tokens=8192,
+                    )
+                )
+            return pool
+
+    def health_check(self) -> dict:
+        """
+        返回各模型客户端池的状态，键为llm_domain，流式客户端带":stream"后缀。
+        """
+        with self._pools_lock:
+            pools = dict(self._pools)
+        return {
+            domain + (":stream" if streaming else ""): pool.health_check()
+            for (_, domain, streaming), pool in pools.items()
+        }
 
     def _ask(self, api_url: str, llm_domain: str, msg: str, context: list = []) -> str:
         """
-        调用接口进行问答
+        调用接口进行问答，先查回答缓存，并与进行中的相同请求合并
         param api_url: 对应大模型的URL
         param llm_domain: 对应大模型的domain
         """
-        spark = ChatSparkLLM(
-            spark_api_url=api_url,
-            spark_app_id=self.app_id,
-            spark_api_key=self.api_key,
-            spark_api_secret=self.api_secret,
-            spark_llm_domain=llm_domain,
-            streaming=False,
-            max_tokens=8192,
+        context = fit_context(context, context_budget(llm_domain))
+        return _answer(
+            llm_domain,
+            msg,
+            context,
+            lambda: self._generate(api_url, llm_domain, msg, context),
+        )
+
+    def _generate(self, api_url: str, llm_domain: str, msg: str, context: list) -> str:
+        messages = self._messages(msg, context)
+        handler = ChunkPrintHandler()
+        a = self._pool(api_url, llm_domain, False).call(
+            lambda spark: spark.generate([messages], callbacks=[handler])
         )
+        return a.generations[0][0].text
+
+    def _messages(self, msg: str, context: list) -> list:
         messages = []
         for thismsg in context:
             messages.append(ChatMessage(role="user", content=thismsg[0]))
             messages.append(ChatMessage(role="assistant", content=thismsg[1]))
         messages.append(ChatMessage(role="user", content=msg))
-        handler = ChunkPrintHandler()
-        a = spark.generate([messages], callbacks=[handler])
-        return a.generations[0][0].text
+        return messages
+
+    async def ask_stream(self, msg: str, context: list = [], model: str = "sparkUltra"):
+        """
+        流式问答，以异步生成器逐段返回AI的回答
+        param msg: 用户输入的问题
+        param context: 上下文
+        param model: 模型名称，见SPARK_MODELS
+        """
+        api_url, llm_domain = SPARK_MODELS[model]
+        context = fit_context(context, context_budget(llm_domain))
+        async for token in _answer_stream(
+            llm_domain, msg, context, self._ask_stream(api_url, llm_domain, msg, context)
+        ):
+            yield token
+
+    async def _ask_stream(self, api_url: str, llm_domain: str, msg: str, context: list):
+        messages = self._messages(msg, context)
+        pool = self._pool(api_url, llm_domain, True)
+
+        def produce(emit):
+            pool.call(
+                lambda spark: spark.generate([messages], callbacks=[_TokenHandler(emit)]),
+                retries=0,
+            )
+
+        async for token in _stream_in_thread(produce):
+            yield token
 
     def sparkUltra(self, msg: str, context: list = []) -> str:
         """
         调用星火认知大模型Spark4.0Ultra进行问答
         param msg: 用户输入的问题
         """
-        return self._ask(
-            "wss://spark-api.xf-yun.com/v4.0/chat", "4.0Ultra", msg, context
-        )
+        return self._ask(*SPARK_MODELS["sparkUltra"], msg, context)
 
     def sparkMax(self, msg: str, context: list = []) -> str:
         """
         调用星火认知大模型Spark Max进行问答
         param msg: 用户输入的问题
         """
-        return self._ask(
-            "wss://spark-api.xf-yun.com/v3.5/chat", "generalv3.5", msg, context
-        )
+        return self._ask(*SPARK_MODELS["sparkMax"], msg, context)
 
     def sparkPro(self, msg: str, context: list = []) -> str:
         """
         调用星火认知大模型Spark Pro进行问答
         param msg: 用户输入的问题
         """
-        return self._ask(
-            "wss://spark-api.xf-yun.com/v3.1/chat", "generalv3", msg, context
-        )
+        return self._ask(*SPARK_MODELS["sparkPro"], msg, context)
 
     def sparkV2(self, msg: str, context: list = []) -> str:
         """
         调用星火认知大模型Spark V2进行问答
         param msg: 用户输入的问题
         """
-        return self._ask(
-            "wss://spark-api.xf-yun.com/v2.1/chat", "generalv2", msg, context
-        )
+        return self._ask(*SPARK_MODELS["sparkV2"], msg, context)
 
     def sparkLite(self, msg: str, context: list = []) -> str:
         """
         调用星火认知大模型Spark Lite进行问答
         param msg: 用户输入的问题
         """
-        return self._ask(
-            "wss://spark-api.xf-yun.com/v1.1/chat", "general", msg, context
-        )
+        return self._ask(*SPARK_MODELS["sparkLite"], msg, context)
 
 
 if __name__ == "__main__":
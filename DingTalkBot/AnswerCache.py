@@ -0,0 +1,338 @@
+from .utils import json, os, re, threading, time
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(msg: str) -> str:
+    """
+    归一化问题：全角转半角、合并空白、转小写并去掉结尾的标点，使写法略有不同的同一问题命中同一条缓存。
+    param msg: 用户输入的问题
+    """
+    msg = unicodedata.normalize("NFKC", msg)
+    return _SPACES.sub(" ", msg).strip().lower().rstrip("?!.。~ ")
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def turn_hash(turn) -> str:
+    """
+    一轮对话[用户问题, 机器人回答]的摘要，用于组成缓存键和按对话记录失效。
+    只取问题和回答，与对话记录是否带token数无关。
+    """
+    return _digest(json.dumps(turn[:2], ensure_ascii=False))
+
+
+def answer_key(model: str, msg: str, context: list) -> tuple:
+    """
+    一次问答的键，模型、归一化后的问题和上下文都相同的问答键相同。
+    return: (键, 上下文各轮的摘要)
+    """
+    turns = tuple(turn_hash(turn) for turn in context)
+    return _digest(json.dumps([model, normalize_question(msg), turns])), turns
+
+
+class AnswerCache:
+    """
+    大模型回答缓存。
+    键为(模型, 归一化后的问题, 上下文)的摘要，上下文相同且问题相同时直接返回之前的回答，不再调用大模型。
+    内存中按LRU+TTL淘汰；指定folder_path时另有SQLite磁盘层，重启后仍可命中。
+    每条缓存记录其上下文包含的对话轮次，清空某个用户的对话记录时删除依赖这些轮次的缓存，
+    公共对话记录变化时所有缓存的上下文都已改变，全部删除。
+    指定semantic时，精确匹配未命中再查语义缓存，问法相近的问题也能命中。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        folder_path: str = None,
+        db_name: str = "answers.db",
+        max_disk_entries: int = 100000,
+        semantic=None,
+    ) -> None:
+        """
+        初始化。
+        param max_entries: 内存中缓存的回答数上限，超出时淘汰最久未命中的
+        param ttl: 回答的有效秒数
+        param folder_path: 磁盘层所在目录，为空时只缓存在内存中
+        param db_name: 磁盘层数据库文件名
+        param max_disk_entries: 磁盘层保留的回答数上限，超出时淘汰最早过期的
+        param semantic: SemanticCache，为空时只做精确匹配
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.semantic = semantic
+        self.hits = 0
+        self.disk_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._entries = OrderedDict()
+        self._by_turn = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_puts = 0
+        if folder_path is not None:
+            os.makedirs(folder_path, exist_ok=True)
+            self._conn = sqlite3.connect(
+                os.path.join(folder_path, db_name), check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, "
+                "turns TEXT NOT NULL, expire_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_turns (turn TEXT NOT NULL, key TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_answer_turns ON answer_turns (turn)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_answers_expire ON answers (expire_at)"
+            )
+            self._conn.commit()
+
+    _SELECT = "SELECT answer, turns, expire_at FROM answers WHERE key = ?"
+    _INSERT = "INSERT OR REPLACE INTO answers (key, answer, turns, expire_at) VALUES (?, ?, ?, ?)"
+    _INSERT_TURN = "INSERT INTO answer_turns (turn, key) VALUES (?, ?)"
+    _DELETE = "DELETE FROM answers WHERE key = ?"
+    _DELETE_TURNS = "DELETE FROM answer_turns WHERE key = ?"
+
+    def key(self, model: str, msg: str, context: list) -> tuple:
+        """
+        计算缓存键，见answer_key。
+        """
+        return answer_key(model, msg, context)
+
+    # ===== 内存层 =====
+
+    def _store(self, key: str, answer: str, turns: tuple, expire_at: float):
+        """
+        写入内存层并按容量淘汰，须持有锁。
+        """
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expire_at, answer, turns)
+        for turn in turns:
+            self._by_turn.setdefault(turn, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        """
+        从内存层删除一条缓存，须持有锁。
+        """
+        _, _, turns = self._entries.pop(key)
+        for turn in turns:
+            keys = self._by_turn.get(turn)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_turn[turn]
+
+    # ===== 磁盘层 =====
+
+    def _disk_get(self, key: str):
+        row = self._conn.execute(self._SELECT, (key,)).fetchone()
+        if row is None:
+            return None
+        answer, turns, expire_at = row
+        if expire_at <= time.time():
+            self._disk_delete([key])
+            return None
+        return answer, tuple(turns.split()), expire_at
+
+    def _disk_put(self, key: str, answer: str, turns: tuple, expire_at: float):
+        self._conn.execute(self._DELETE_TURNS, (key,))
+        self._conn.execute(self._INSERT, (key, answer, " ".join(turns), expire_at))
+        self._conn.executemany(self._INSERT_TURN, [(turn, key) for turn in set(turns)])
+        self._disk_puts += 1
+        if self._disk_puts % 1000 == 0:
+            self._disk_prune()
+        self._conn.commit()
+
+    def _disk_prune(self):
+        """
+        删除磁盘层中过期和超出容量的缓存。
+        """
+        self._conn.execute("DELETE FROM answers WHERE expire_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM answers WHERE key IN ("
+            "SELECT key FROM answers ORDER BY expire_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        self._conn.execute(
+            "DELETE FROM answer_turns WHERE key NOT IN (SELECT key FROM answers)"
+        )
+
+    def _disk_delete(self, keys):
+        for key in keys:
+            self._conn.execute(self._DELETE, (key,))
+            self._conn.execute(self._DELETE_TURNS, (key,))
+        self._conn.commit()
+
+    # ===== 缓存接口 =====
+
+    def get(self, model: str, msg: str, context: list) -> str:
+        """
+        查找缓存的回答。
+        param model: 模型名称
+        param msg: 用户输入的问题
+        param context: 上下文，格式为[[用户问题1,机器人回答1],...]
+        return: 缓存的回答，未命中时为None
+        """
+        key, _ = self.key(model, msg, context)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+            if self._conn is not None:
+                row = self._disk_get(key)
+                if row is not None:
+                    answer, turns, expire_at = row
+                    self._store(key, answer, turns, expire_at)
+                    self.disk_hits += 1
+                    return answer
+        # 语义缓存自带锁，矩阵运算期间不阻塞精确匹配
+        if self.semantic is not None:
+            answer = self.semantic.get(model, msg, context)
+            if answer is not None:
+                with self._lock:
+                    self.semantic_hits += 1
+                return answer
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model: str, msg: str, context: list, answer: str):
+        """
+        缓存一条回答，参数同get。
+        """
+        key, turns = self.key(model, msg, context)
+        expire_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, answer, turns, expire_at)
+            if self._conn is not None:
+                self._disk_put(key, answer, turns, expire_at)
+        if self.semantic is not None:
+            self.semantic.put(model, msg, context, answer)
+
+    def call(self, model: str, msg: str, context: list, func) -> str:
+        """
+        命中时返回缓存的回答，否则调用func()并缓存其结果。
+        param func: 调用大模型的无参函数
+        """
+        answer = self.get(model, msg, context)
+        if answer is None:
+            answer = func()
+            self.put(model, msg, context, answer)
+        return answer
+
+    def invalidate(self, context: list) -> int:
+        """
+        删除上下文中包含任意一轮给定对话的缓存，用于清空用户的对话记录时。
+        param context: 被删除的对话记录，格式同get
+        return: 删除的缓存数
+        """
+        turns = {turn_hash(turn) for turn in context}
+        with self._lock:
+            keys = set()
+            for turn in turns:
+                keys.update(self._by_turn.get(turn, ()))
+            for key in keys:
+                self._remove(key)
+            if self._conn is not None:
+                for turn in turns:
+                    keys.update(
+                        key
+                        for (key,) in self._conn.execute(
+                            "SELECT key FROM answer_turns WHERE turn = ?", (turn,)
+                        )
+                    )
+                self._disk_delete(keys)
+            self.invalidated += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """
+        删除所有缓存，用于公共对话记录变化时。
+        """
+        with self._lock:
+            self.invalidated += len(self._entries)
+            self._entries.clear()
+            self._by_turn.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM answers")
+                self._conn.execute("DELETE FROM answer_turns")
+                self._conn.commit()
+        if self.semantic is not None:
+            self.semantic.clear()
+
+    def stats(self) -> dict:
+        """
+        return: 内存层缓存数、内存命中数、磁盘命中数、语义命中数、未命中数、失效删除数
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+            }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+
+def create_answer_cache(config: dict = None) -> AnswerCache:
+    """
+    根据配置创建回答缓存。
+    param config: 如{"max_entries": 1024, "ttl": 3600, "folder_path": "answers"}，见AnswerCache；
+        semantic为语义缓存配置，如{"threshold": 0.9, "max_entries": 10000}，见SemanticCache，需要安装numpy
+    """
+    config = dict(config or {})
+    semantic = config.pop("semantic", None)
+    if semantic is not None:
+        semantic = dict(semantic)
+        if semantic.pop("enabled", True):
+            from .SemanticCache import SemanticCache
+
+            config["semantic"] = SemanticCache(**semantic)
+    return AnswerCache(**config)
+
+
+_answer_cache = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    获取进程内共享的回答缓存，未启用时为None。
+    """
+    return _answer_cache
+
+
+def set_answer_cache(cache: AnswerCache):
+    """
+    设置进程内共享的回答缓存，所有大模型客户端共用。
+    param cache: 回答缓存，为None时不缓存
+    """
+    global _answer_cache
+    _answer_cache = cache
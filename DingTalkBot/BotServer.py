@@ -1,17 +1,64 @@
 from .utils import dingtalk_stream, json
-from .MsgSender import PatchSender, GroupSender
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import contextvars
+import functools
+import time
+from .MsgSender import PatchSender, GroupSender, CardSender
+from .Token import get_token_manager
+from .RateLimiter import get_rate_limiter
+from .Dispatcher import Dispatcher
+from .Retry import create_retry_policy, get_retry_policy, set_retry_policy
+from .Session import create_session, set_session
+from .Outbox import create_outbox
+from .Dedup import DedupCache
+from .AnswerCache import create_answer_cache, set_answer_cache
+from .SingleFlight import SingleFlight, get_single_flight, set_single_flight
+from .Summarizer import ContextSummarizer
+import dingtalk
 from .AiModle import *
+from .Context import create_context_store
 from .func import (
-    context_reader,
+    set_context_store,
+    context_window,
     context_recorder,
     context_deleter,
     add_public_context,
-    read_public_context,
     delete_public_context,
 )
 
 mygpt = GPT4Free()
 
+# 当前消息所属应用的token管理器，多机器人时SDK请求据此取对应应用的token
+current_token_manager = contextvars.ContextVar("current_token_manager", default=None)
+
+
+async def flush_stream(
+    tokens, update, interval: float = 0.3, min_chars: int = 50
+) -> str:
+    """
+    累积流式返回的文本，每隔interval秒或新增min_chars个字符推送一次。
+    param tokens: 产生文本片段的异步迭代器
+    param update: 异步函数update(text)，用目前累积的全部文本更新消息
+    param interval: 两次推送之间的最短间隔（秒）
+    param min_chars: 新增字符数达到该值时不等间隔直接推送
+    return: 完整的回答
+    """
+    loop = asyncio.get_running_loop()
+    text = ""
+    flushed = 0
+    last = loop.time()
+    async for token in tokens:
+        text += token
+        if loop.time() - last >= interval or len(text) - flushed >= min_chars:
+            await update(text)
+            flushed = len(text)
+            last = loop.time()
+    if len(text) != flushed:
+        await update(text)
+    return text
+
 
 class CalcBotHandler(dingtalk_stream.ChatbotHandler):
     """
@@ -22,15 +69,56 @@ class CalcBotHandler(dingtalk_stream.ChatbotHandler):
             处理收到的消息，提取并打印表达式，并返回处理状态和消息。
     """
 
-    def __init__(self, PatchSender: PatchSender, GroupSender: GroupSender):
+    def __init__(
+        self,
+        PatchSender: PatchSender,
+        GroupSender: GroupSender,
+        max_workers: int = 16,
+        max_concurrency: int = 32,
+        per_user_concurrency: int = 1,
+        CardSender: CardSender = None,
+        stream: dict = None,
+        executor: ThreadPoolExecutor = None,
+        token_manager=None,
+        dedup: DedupCache = None,
+        summarizer: ContextSummarizer = None,
+    ):
         """
         初始化处理器。
 
         参数:
             PatchSender (PatchSender): 消息发送器对象。
+            GroupSender (GroupSender): 群消息发送器对象。
+            CardSender (CardSender): 卡片发送器对象，流式输出时使用。
+            stream (dict): 流式输出配置，如{"interval": 0.3, "min_chars": 50}，为空时等待完整回答后再发送。
+            max_workers (int): 执行阻塞调用的线程池大小。
+            max_concurrency (int): 全局同时处理的消息数上限。
+            per_user_concurrency (int): 单个用户同时处理的消息数上限，默认1以保证同一用户的对话按顺序处理。
+            executor (ThreadPoolExecutor): 执行阻塞调用的线程池，多个机器人可共用一个，为空时按max_workers新建。
+            token_manager (TokenManager): 所属应用的token管理器，处理消息期间作为SDK请求的默认token来源。
+            dedup (DedupCache): 按msgId去重的缓存，重投的消息不再重复处理，为空时不去重。
+            summarizer (ContextSummarizer): 对话记录接近上限时在后台把旧对话总结成摘要，为空时直接舍弃最旧的对话。
         """
         self.PatchSender = PatchSender
         self.GroupSender = GroupSender
+        self.CardSender = CardSender
+        self.stream = stream
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="CalcBotHandler"
+        )
+        self.token_manager = token_manager
+        self.dedup = dedup
+        self.summarizer = summarizer
+        self.per_user_concurrency = per_user_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._user_semaphores = {}
+        self.metrics = {
+            "received": 0,
+            "handled": 0,
+            "failed": 0,
+            "inflight": 0,
+            "seconds": 0.0,
+        }
 
     async def process(
         self, callback: dingtalk_stream.CallbackMessage
@@ -71,168 +159,456 @@ class CalcBotHandler(dingtalk_stream.ChatbotHandler):
 
 
         """
-        incoming_message = dingtalk_stream.ChatbotMessage.from_dict(callback.data)
-        expression = incoming_message.text.content.strip()  # 提取并清理消息内容
-        # 判断是否是群聊
-        if callback.data["conversationType"] == "2":
-            print(callback.data["conversationId"])
-            # 群聊
-            if expression == "/clear":
-                context_deleter(callback.data["senderStaffId"])
-                self.GroupSender.send_markdown(
-                    title="AI回复",
-                    content="**对话记录已清空**",
-                    openConversationId=callback.data["conversationId"],
-                )
-                return dingtalk_stream.AckMessage.STATUS_OK, "OK"
-            if expression == "/clear_public":
-                delete_public_context()
-                self.GroupSender.send_markdown(
-                    title="AI回复",
-                    content="**公共对话记录已清空**",
-                    openConversationId=callback.data["conversationId"],
-                )
-                return dingtalk_stream.AckMessage.STATUS_OK, "OK"
-            openConversationId = callback.data["conversationId"]
-            self.GroupSender.send_markdown(
+        data = callback.data
+        metrics = self.metrics
+        metrics["received"] += 1
+        metrics["inflight"] += 1
+        started = time.monotonic()
+        token = current_token_manager.set(self.token_manager)
+        try:
+            if self.dedup is None:
+                await self._process(data)
+            else:
+                await self.dedup.run(data.get("msgId"), self._process, data)
+        except Exception:
+            metrics["failed"] += 1
+            raise
+        else:
+            metrics["handled"] += 1
+        finally:
+            metrics["inflight"] -= 1
+            metrics["seconds"] += time.monotonic() - started
+            current_token_manager.reset(token)
+        return dingtalk_stream.AckMessage.STATUS_OK, "OK"
+
+    async def _process(self, data: dict):
+        async with self._limit(data["senderStaffId"]):
+            await self._handle(data)
+
+    def stats(self) -> dict:
+        """
+        本机器人的处理统计：收到、处理完成、失败、处理中的消息数和平均处理耗时(秒)，
+        启用去重时另有dedup字段，见DedupCache.stats。
+        """
+        metrics = dict(self.metrics)
+        done = metrics["handled"] + metrics["failed"]
+        seconds = metrics.pop("seconds")
+        metrics["avg_seconds"] = seconds / done if done else 0.0
+        if self.dedup is not None:
+            metrics["dedup"] = self.dedup.stats()
+        return metrics
+
+    @contextlib.asynccontextmanager
+    async def _limit(self, user_id: str):
+        """
+        并发控制：先占用该用户的名额，再占用全局名额，避免同一用户排队的消息占满全局名额。
+        param user_id: 用户ID
+        """
+        entry = self._user_semaphores.get(user_id)
+        if entry is None:
+            entry = self._user_semaphores[user_id] = [
+                asyncio.Semaphore(self.per_user_concurrency),
+                0,
+            ]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._semaphore:
+                    yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_semaphores[user_id]
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        在线程池中执行阻塞调用（大模型问答、消息发送、文件读写），不阻塞事件循环。
+        线程中沿用当前上下文，SDK请求可以取到所属应用的token。
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, context.run, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _reply(self, data: dict, content: str):
+        """
+        回复markdown消息，群聊发到群里，单聊发给发送者。
+        param data: 回调消息数据
+        param content: 回复内容
+        """
+        if data["conversationType"] == "2":
+            return await self._run(
+                self.GroupSender.send_markdown,
                 title="AI回复",
-                content="**正在思考中，请稍等**",
-                openConversationId=openConversationId,
-            )
-            personal_context, full_warning = context_reader(
-                callback.data["senderStaffId"]
-            )
-            public_context = read_public_context()
-            context = public_context + personal_context
-            if full_warning:
-                self.GroupSender.send_markdown(
-                    title="AI回复",
-                    content="**对话长度已满，将舍弃最旧对话**",
-                    openConversationId=openConversationId,
-                )
-            if "/public" in expression:
-                # 获取public字符串后面的内容，添加到公共对话记录
-                public_context = expression.split("/public")[1].strip()
-                old_expression = expression
-                expression = public_context
-            reply = mygpt.ask(expression, context)
-            self.GroupSender.send_markdown(
-                title="AI回复", content=reply, openConversationId=openConversationId
+                content=content,
+                openConversationId=data["conversationId"],
             )
-            if "/public" in old_expression:
-                con_list = [expression, reply]
-                add_public_context(con_list)
-                self.GroupSender.send_markdown(
-                    title="AI回复",
-                    content="**已添加到公共对话记录**",
-                    openConversationId=openConversationId,
-                )
-            else:
-                context_recorder(callback.data["senderStaffId"], expression, reply)
+        return await self._run(
+            self.PatchSender.send_markdown,
+            title="AI回复",
+            content=content,
+            user_ids=[data["senderStaffId"]],
+        )
 
+    async def _reply_stream(self, data: dict, expression: str, context: list) -> str:
+        """
+        先发送一张卡片，再把流式生成的回答按配置的节奏更新到卡片上。
+        param data: 回调消息数据
+        param expression: 用户问题
+        param context: 上下文
+        return: 完整的回答
+        """
+        if data["conversationType"] == "2":
+            target = {"openConversationId": data["conversationId"]}
         else:
-            # 单聊
-            if expression == "/clear":
-                context_deleter(callback.data["senderStaffId"])
-                self.PatchSender.send_markdown(
-                    title="AI回复",
-                    content="**对话记录已清空**",
-                    user_ids=[callback.data["senderStaffId"]],
-                )
-                return dingtalk_stream.AckMessage.STATUS_OK, "OK"
-            if expression == "/clear_public":
-                delete_public_context()
-                self.GroupSender.send_markdown(
-                    title="AI回复",
-                    content="**公共对话记录已清空**",
-                    openConversationId=callback.data["conversationId"],
-                )
-                return dingtalk_stream.AckMessage.STATUS_OK, "OK"
-            sender_id = callback.data["senderStaffId"]
-            self.PatchSender.send_markdown(
-                title="AI回复", content="**正在思考中，请稍等**", user_ids=[sender_id]
-            )
-            personal_context, full_warning = context_reader(
-                callback.data["senderStaffId"]
-            )
-            public_context = read_public_context()
-            context = public_context + personal_context
-            if full_warning:
-                self.PatchSender.send_markdown(
-                    title="AI回复",
-                    content="**对话长度已满，将舍弃最旧对话**",
-                    user_ids=[sender_id],
-                )
-            if "/public" in expression:
-                # 获取public字符串后面的内容，添加到公共对话记录
-                public_context = expression.split("/public")[1].strip()
-                old_expression = expression
-                expression = public_context
-
-            reply = mygpt.ask(expression, context)
-            self.PatchSender.send_markdown(
-                title="AI回复", content=reply, user_ids=[sender_id]
+            target = {"user_id": data["senderStaffId"]}
+        card_id = await self._run(
+            self.CardSender.send_markdown_card,
+            "AI回复",
+            "**正在思考中，请稍等**",
+            **target,
+        )
+
+        async def update(text):
+            await self._run(
+                self.CardSender.update_markdown_card, card_id, "AI回复", text
             )
 
-            if "/public" in old_expression:
-                # 获取public字符串后面的内容，添加到公共对话记录
-                con_list = [expression, reply]
-                add_public_context(con_list)
-                self.PatchSender.send_markdown(
-                    title="AI回复",
-                    content="**已添加到公共对话记录**",
-                    user_ids=[sender_id],
-                )
-            else:
-                context_recorder(callback.data["senderStaffId"], expression, reply)
+        return await flush_stream(
+            mygpt.ask_stream(expression, context), update, **self.stream
+        )
 
-        return dingtalk_stream.AckMessage.STATUS_OK, "OK"
+    async def _handle(self, data: dict):
+        """
+        处理一条消息。
+        param data: 回调消息数据
+        """
+        incoming_message = dingtalk_stream.ChatbotMessage.from_dict(data)
+        expression = incoming_message.text.content.strip()  # 提取并清理消息内容
+        sender_id = data["senderStaffId"]
+        if expression == "/clear":
+            await self._run(context_deleter, sender_id)
+            await self._reply(data, "**对话记录已清空**")
+            return
+        if expression == "/clear_public":
+            await self._run(delete_public_context)
+            await self._reply(data, "**公共对话记录已清空**")
+            return
+        streaming = self.CardSender is not None and self.stream is not None
+        if not streaming:
+            await self._reply(data, "**正在思考中，请稍等**")
+        # 按模型的token预算组装上下文，过长的旧对话不再拖慢每次请求；
+        # 启用摘要时在距离上限还有keep轮时就开始摘要，使摘要在最旧的对话被挤出之前完成
+        margin = self.summarizer.keep if self.summarizer is not None else 0
+        context, full_warning = await self._run(
+            context_window, sender_id, context_budget(mygpt.model), margin
+        )
+        if full_warning:
+            if self.summarizer is not None:
+                # 后台总结旧对话，不等待结果
+                self.summarizer.request(sender_id)
+            else:
+                await self._reply(data, "**对话长度已满，将舍弃最旧对话**")
+        is_public = "/public" in expression
+        if is_public:
+            # 获取public字符串后面的内容，添加到公共对话记录
+            expression = expression.split("/public")[1].strip()
+        if streaming:
+            reply = await self._reply_stream(data, expression, context)
+        else:
+            reply = await self._run(mygpt.ask, expression, context)
+            await self._reply(data, reply)
+        if is_public:
+            await self._run(add_public_context, [expression, reply])
+            await self._reply(data, "**已添加到公共对话记录**")
+        else:
+            await self._run(context_recorder, sender_id, expression, reply)
 
 
 class BotServer:
 
-    def __init__(self, client_id: str, client_secret: str) -> None:
-        self.client_id = client_id
-        self.client_secret = client_secret
-        if not self.client_id or not self.client_secret:
-            raise ValueError("client_id或client_secret未配置")
+    def __init__(
+        self,
+        client_id: str = None,
+        client_secret: str = None,
+        max_workers: int = 16,
+        max_concurrency: int = 32,
+        per_user_concurrency: int = 1,
+        context: dict = None,
+        stream: dict = None,
+        dispatcher: dict = None,
+        retry: dict = None,
+        http: dict = None,
+        outbox: dict = None,
+        apps: list = None,
+        dedup: dict = None,
+        answer_cache: dict = None,
+        summarize: dict = None,
+        ai: dict = None,
+        single_flight: dict = None,
+    ) -> None:
+        """
+        初始化。
+        param client_id: 客户端ID。
+        param client_secret: 客户端密钥。
+        param max_workers: 执行阻塞调用的线程池大小。
+        param max_concurrency: 全局同时处理的消息数上限。
+        param per_user_concurrency: 单个用户同时处理的消息数上限。
+        param context: 对话记录存储配置，如{"backend": "sqlite"}，见create_context_store。
+        param stream: 流式输出配置，如{"interval": 0.3, "min_chars": 50}，为空或enabled为false时不启用。
+        param dispatcher: 后台发送队列配置，如{"workers": 8, "max_depth": 1000}，见Dispatcher。
+        param retry: 重试策略配置，如{"max_attempts": 4, "deadline": 30}，见create_retry_policy。
+        param http: HTTP连接池配置，如{"pool_maxsize": 32, "http2": false}，见create_session。
+        param outbox: 持久化发件箱配置，如{"backend": "log"}，见create_outbox，为空或enabled为false时不启用。
+        param apps: 在同一进程中运行的多个机器人应用，如[{"name": "bot1", "client_id": "...", "client_secret": "..."}]，
+            为空时只运行client_id对应的应用。各应用有独立的流连接和消息处理器，
+            共用事件循环、线程池、HTTP连接池、token缓存、发送队列和大模型客户端。
+        param dedup: 消息去重配置，如{"ttl": 600, "max_size": 10000}，见DedupCache，默认启用，enabled为false时不启用。
+        param answer_cache: 大模型回答缓存配置，如{"ttl": 3600, "folder_path": "answers"}，见AnswerCache，为空或enabled为false时不启用。
+        param summarize: 对话摘要配置，如{"model": "sparkLite", "turns": 10}，model为SPARK_MODELS中的模型或gpt4free，
+            其余参数见ContextSummarizer，为空或enabled为false时不启用。
+        param ai: 大模型配置，即config.json中的AI部分，使用星火模型摘要时需要其中的SparkAi。
+        param single_flight: 合并相同的进行中大模型请求的配置，见SingleFlight，默认启用，enabled为false时不启用。
+        """
+        if not apps:
+            apps = [{"client_id": client_id, "client_secret": client_secret}]
+        self.apps = []
+        for app in apps:
+            if not app.get("client_id") or not app.get("client_secret"):
+                raise ValueError("client_id或client_secret未配置")
+            self.apps.append(dict(app, name=app.get("name") or app["client_id"]))
+        names = [app["name"] for app in self.apps]
+        if len(set(names)) != len(names):
+            raise ValueError(f"机器人应用名称重复: {names}")
+        self.client_id = self.apps[0]["client_id"]
+        self.client_secret = self.apps[0]["client_secret"]
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.context = context
+        if stream is not None:
+            stream = dict(stream)
+            if not stream.pop("enabled", True):
+                stream = None
+        self.stream = stream
+        self.dispatcher = dispatcher or {}
+        self.retry = retry
+        self.http = http
+        if outbox is not None:
+            outbox = dict(outbox)
+            if not outbox.pop("enabled", True):
+                outbox = None
+        self.outbox = outbox
+        dedup = dict(dedup or {})
+        if not dedup.pop("enabled", True):
+            dedup = None
+        self.dedup = dedup
+        if answer_cache is not None:
+            answer_cache = dict(answer_cache)
+            if not answer_cache.pop("enabled", True):
+                answer_cache = None
+        self.answer_cache = answer_cache
+        single_flight = dict(single_flight or {})
+        if not single_flight.pop("enabled", True):
+            single_flight = None
+        self.single_flight = single_flight
+        if summarize is not None:
+            summarize = dict(summarize)
+            if not summarize.pop("enabled", True):
+                summarize = None
+        if summarize is not None:
+            model = summarize.get("model", "sparkLite")
+            if model != "gpt4free" and model not in SPARK_MODELS:
+                raise ValueError(f"不支持的摘要模型: {model}")
+            if model != "gpt4free" and not (ai or {}).get("SparkAi"):
+                raise ValueError("使用星火模型摘要需要配置AI.SparkAi")
+        self.summarize = summarize
+        self.ai = ai
+        self.summarizer = None
+        self.handlers = {}
 
     def run(self):
         """
         服务端启动函数
 
         操作步骤:
-            1. 创建消息发送器对象。
-            2. 创建凭证对象。
-            3. 创建钉钉流客户端对象。
-            4. 注册回调处理程序。
-            5. 启动客户端并持续运行。
-        """
-        # 创建消息发送器对象
-        patch_sender = PatchSender(
-            client_id=self.client_id, client_secret=self.client_secret
+            1. 创建各应用共享的存储、连接池、限流器、重试策略和线程池。
+            2. 为每个应用创建token管理器、消息发送器和消息处理器。
+            3. 为每个应用创建凭证对象和钉钉流客户端对象并注册回调处理程序。
+            4. 在同一个事件循环中启动所有客户端并持续运行，退出时关闭发送队列。
+        """
+        if self.context:
+            set_context_store(create_context_store(self.context))
+        # 上下文和问题都相同的提问直接返回缓存的回答，各应用共用
+        if self.answer_cache is not None:
+            set_answer_cache(create_answer_cache(self.answer_cache))
+        # 相同的问题正在请求大模型时等待其结果，不再重复调用，各应用共用
+        set_single_flight(
+            SingleFlight(**self.single_flight) if self.single_flight is not None else None
+        )
+        # 所有发送器和token刷新共用一组长连接
+        if self.http is not None:
+            set_session(create_session(**self.http))
+        # 共享token缓存，SDK请求未显式传入token时使用当前消息所属应用的token
+        default_manager = get_token_manager(self.client_id, self.client_secret)
+        dingtalk.setDefaultTokenProvider(
+            lambda: (current_token_manager.get() or default_manager).get_token()
+        )
+        # SDK请求与消息发送共用一个限流器
+        dingtalk.setDefaultRateLimiter(get_rate_limiter())
+        # 发送、token刷新和SDK请求共用一个重试策略及其重试预算
+        if self.retry is not None:
+            set_retry_policy(create_retry_policy(self.retry))
+        dingtalk.setDefaultRetryPolicy(get_retry_policy())
+        # 回复消息交给后台队列发送，不占用消息处理的时间；启用发件箱时先落盘
+        dispatcher = Dispatcher(**self.dispatcher)
+        outbox = create_outbox(self.outbox) if self.outbox else None
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="CalcBotHandler"
         )
-        group_sender = GroupSender(
-            client_id=self.client_id, client_secret=self.client_secret
+        # 旧对话的摘要在独立线程中用低成本模型生成，各应用共用
+        if self.summarize is not None:
+            self.summarizer = self._create_summarizer()
+        clients = []
+        senders = []
+        for app in self.apps:
+            client_id, client_secret = app["client_id"], app["client_secret"]
+            # 创建消息发送器对象
+            patch_sender = PatchSender(
+                client_id=client_id,
+                client_secret=client_secret,
+                dispatcher=dispatcher,
+                outbox=outbox,
+            )
+            group_sender = GroupSender(
+                client_id=client_id,
+                client_secret=client_secret,
+                dispatcher=dispatcher,
+                outbox=outbox,
+            )
+            # 重发上次退出前未送达的回复
+            replayed = patch_sender.replay() + group_sender.replay()
+            if replayed:
+                print(f"{app['name']}: 重发了{replayed}条未送达的消息")
+            card_sender = None
+            if self.stream is not None:
+                card_sender = CardSender(
+                    client_id=client_id, client_secret=client_secret
+                )
+            handler = CalcBotHandler(
+                PatchSender=patch_sender,
+                GroupSender=group_sender,
+                max_workers=self.max_workers,
+                max_concurrency=self.max_concurrency,
+                per_user_concurrency=self.per_user_concurrency,
+                CardSender=card_sender,
+                stream=self.stream,
+                executor=executor,
+                token_manager=get_token_manager(client_id, client_secret),
+                dedup=DedupCache(**self.dedup) if self.dedup is not None else None,
+                summarizer=self.summarizer,
+            )
+            self.handlers[app["name"]] = handler
+            # 创建凭证对象
+            credential = dingtalk_stream.Credential(client_id, client_secret)
+            # 创建钉钉流客户端对象
+            client = dingtalk_stream.DingTalkStreamClient(credential)
+            # 注册回调处理程序
+            client.register_callback_handler(
+                dingtalk_stream.chatbot.ChatbotMessage.TOPIC, handler
+            )
+            clients.append((app["name"], client))
+            senders.extend((patch_sender, group_sender))
+        # 在同一个事件循环中启动所有客户端并持续运行，退出时发送完已排队的回复
+        try:
+            asyncio.run(self._serve(clients, outbox, senders, executor))
+        finally:
+            dispatcher.close()
+
+    def _create_summarizer(self) -> ContextSummarizer:
+        config = dict(self.summarize)
+        model = config.pop("model", "sparkLite")
+        # 摘要内容因人而异，直接调用模型，不经过回答缓存和请求合并
+        if model == "gpt4free":
+            return ContextSummarizer(mygpt._ask, **config)
+        spark = self.ai["SparkAi"]
+        spark_ai = SparkAI(spark["app_id"], spark["api_key"], spark["api_secret"])
+        return ContextSummarizer(
+            functools.partial(spark_ai._generate, *SPARK_MODELS[model]), **config
         )
-        # 创建凭证对象
-        credential = dingtalk_stream.Credential(self.client_id, self.client_secret)
-        # 创建钉钉流客户端对象
-        client = dingtalk_stream.DingTalkStreamClient(credential)
-        # 注册回调处理程序
-        client.register_callback_handler(
-            dingtalk_stream.chatbot.ChatbotMessage.TOPIC,
-            CalcBotHandler(PatchSender=patch_sender, GroupSender=group_sender),
+
+    async def _serve(self, clients: list, outbox, senders: list, executor):
+        tasks = [self._serve_client(name, client) for name, client in clients]
+        if outbox is not None:
+            tasks.append(self._redeliver(outbox, senders, executor))
+        await asyncio.gather(*tasks)
+
+    async def _redeliver(self, outbox, senders: list, executor):
+        """
+        每隔outbox.retry_delay秒重发一次发送失败且已过退避时间的消息，失败次数达到上限的消息由发件箱移入死信文件。
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(outbox.retry_delay)
+            for sender in senders:
+                try:
+                    await loop.run_in_executor(executor, sender.replay)
+                except Exception as e:
+                    print(f"重发消息失败: {e}")
+
+    async def _serve_client(self, name: str, client):
+        """
+        运行一个流客户端，连接断开或出错后等待3秒重连，与start_forever一致。
+        """
+        while True:
+            try:
+                await client.start()
+            except Exception as e:
+                print(f"{name}: 流连接异常: {e}")
+            await asyncio.sleep(3)
+
+    def stats(self) -> dict:
+        """
+        各应用的消息处理统计，启用请求合并时另有single_flight字段，见SingleFlight.stats。
+        return: {"apps": {应用名称: CalcBotHandler.stats()}, "single_flight": {...}}
+        """
+        stats = {
+            "apps": {name: handler.stats() for name, handler in self.handlers.items()}
+        }
+        flight = get_single_flight()
+        if flight is not None:
+            stats["single_flight"] = flight.stats()
+        return stats
+
+    @classmethod
+    def from_config(cls, config: dict) -> "BotServer":
+        """
+        根据config.json的内容创建服务端，各配置项见__init__。
+        param config: 完整的配置字典，concurrency中的键作为max_workers等并发参数
+        """
+        return cls(
+            client_id=config.get("client_id"),
+            client_secret=config.get("client_secret"),
+            context=config.get("context"),
+            stream=config.get("stream"),
+            dispatcher=config.get("dispatcher"),
+            retry=config.get("retry"),
+            http=config.get("http"),
+            outbox=config.get("outbox"),
+            apps=config.get("apps"),
+            dedup=config.get("dedup"),
+            answer_cache=config.get("answer_cache"),
+            single_flight=config.get("single_flight"),
+            summarize=config.get("summarize"),
+            ai=config.get("AI"),
+            **config.get("concurrency", {}),
         )
-        # 启动客户端并持续运行
-        client.start_forever()
 
 
 if __name__ == "__main__":
 
     with open("config.json", "r") as f:
         config = json.load(f)
-    server = BotServer(
-        client_id=config["client_id"], client_secret=config["client_secret"]
-    )
+    server = BotServer.from_config(config)
     server.run()
@@ -0,0 +1,654 @@
+from .utils import json, os, threading
+from collections import OrderedDict, deque
+import atexit
+import sqlite3
+import tempfile
+
+def count_tokens(text: str) -> int:
+    """
+    估算文本的token数：中文等多字节字符每个约1个token，ASCII字符约4个1个token。
+    多字节字符数由UTF-8编码长度推算(中文3字节、ASCII 1字节)，不逐字符匹配。
+    param text: 文本
+    """
+    length = len(text)
+    wide = (len(text.encode()) - length) // 2
+    return wide + (length - wide + 3) // 4
+
+
+def make_turn(user_msg: str, bot_msg: str) -> list:
+    """
+    创建一轮对话记录[用户问题, 机器人回答, token数]，token数随对话一起保存，组装上下文时无需重新计算。
+    """
+    return [user_msg, bot_msg, count_tokens(user_msg) + count_tokens(bot_msg)]
+
+
+def _with_tokens(turn) -> list:
+    """
+    旧格式的对话记录只有[用户问题, 机器人回答]，补上token数。
+    """
+    if len(turn) > 2:
+        return turn
+    return make_turn(turn[0], turn[1])
+
+
+def fit_context(context: list, budget: int) -> list:
+    """
+    从最新的一轮往前取对话记录，直到token数达到预算。
+    param context: 对话记录列表
+    param budget: token预算
+    return: 预算内最新的若干轮对话
+    """
+    used = 0
+    start = len(context)
+    while start > 0:
+        tokens = _with_tokens(context[start - 1])[2]
+        if used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    return context[start:]
+
+
+class Turns(deque):
+    """
+    对话窗口：按轮数(maxlen)和token总数(max_tokens)两个上限保留最新的对话，并维护窗口内的token总数。
+    每轮对话只在加入和移出时各计一次，超出上限时从最旧的一端移出，每条消息均摊O(1)。
+    """
+
+    def __init__(self, turns=(), maxlen: int = None, max_tokens: int = None):
+        """
+        初始化。
+        param turns: 初始的对话记录，可以是不带token数的旧格式
+        param maxlen: 最多保留的轮数
+        param max_tokens: 最多保留的token数，至少保留最新的一轮
+        """
+        super().__init__(maxlen=maxlen)
+        self.max_tokens = max_tokens
+        self.tokens = 0
+        self.dropped = 0
+        for turn in turns:
+            self.add(turn)
+
+    def add(self, turn) -> list:
+        """
+        加入一轮对话，超出上限时移出最旧的。
+        return: 带token数的对话记录
+        """
+        turn = _with_tokens(turn)
+        if self.maxlen is not None and len(self) == self.maxlen:
+            self.tokens -= self[0][2]
+            self.dropped += 1
+        self.append(turn)
+        self.tokens += turn[2]
+        if self.max_tokens is not None:
+            while len(self) > 1 and self.tokens > self.max_tokens:
+                self.tokens -= self.popleft()[2]
+                self.dropped += 1
+        return turn
+
+    @property
+    def full(self) -> bool:
+        """
+        窗口是否已满：达到轮数上限，或已因上限舍弃过旧对话。
+        """
+        return self.dropped > 0 or (
+            self.maxlen is not None and len(self) >= self.maxlen
+        )
+
+    def near_full(self, margin: int) -> bool:
+        """
+        窗口是否已满，或再加入margin轮对话就会开始舍弃旧对话。
+        按token上限判断时，以窗口内平均每轮的token数估算margin轮对话的token数。
+        param margin: 距离上限的轮数，为0时同full
+        """
+        if self.full:
+            return True
+        if margin <= 0:
+            return False
+        if self.maxlen is not None and len(self) + margin >= self.maxlen:
+            return True
+        return (
+            self.max_tokens is not None
+            and len(self) > 0
+            and self.tokens + margin * self.tokens / len(self) >= self.max_tokens
+        )
+
+    def newest(self, budget: int) -> list:
+        """
+        预算内最新的若干轮对话，只遍历被选中的轮次。
+        """
+        taken = []
+        used = 0
+        for turn in reversed(self):
+            if used + turn[2] > budget:
+                break
+            used += turn[2]
+            taken.append(turn)
+        taken.reverse()
+        return taken
+
+
+class ContextStore:
+    """
+    对话记录存储。
+    活跃用户的对话缓存在内存LRU中，每个用户一个Turns窗口，按轮数和token数两个上限保留最新的对话；
+    修改后不立即写盘，而是延迟一段时间合并写入，写入采用临时文件+重命名保证原子性。
+    文件格式与之前一致：contexts/<user_id>.json 和 contexts/public.json。
+    """
+
+    suffix = ".json"
+
+    def __init__(
+        self,
+        folder_path: str = "contexts",
+        max_turns: int = 20,
+        max_public_turns: int = 50,
+        max_users: int = 1024,
+        flush_delay: float = 1.0,
+        max_tokens: int = None,
+    ) -> None:
+        """
+        初始化。
+        param folder_path: 对话记录目录
+        param max_turns: 每个用户保留的最大对话轮数
+        param max_public_turns: 公共对话记录保留的最大轮数
+        param max_users: 内存中缓存的用户数上限，超出时淘汰最久未访问的用户
+        param flush_delay: 修改后延迟多少秒合并写盘
+        param max_tokens: 每个用户保留的最大token数，为空时只按轮数限制
+        """
+        self.folder_path = folder_path
+        self.max_turns = max_turns
+        self.max_public_turns = max_public_turns
+        self.max_tokens = max_tokens
+        self.max_users = max_users
+        self.flush_delay = flush_delay
+        self._users = OrderedDict()
+        self._public = None
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self._timer = None
+        self._folder_ready = False
+        atexit.register(self.flush)
+
+    def _path(self, name: str) -> str:
+        if not self._folder_ready:
+            os.makedirs(self.folder_path, exist_ok=True)
+            self._folder_ready = True
+        return os.path.join(self.folder_path, name + self.suffix)
+
+    def _load(self, name: str) -> list:
+        try:
+            with open(self._path(name), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _write(self, name: str, record: list):
+        """
+        原子写入：先写临时文件再重命名，进程中途退出也不会留下半个文件。
+        """
+        path = self._path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder_path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _get(self, user_id: str) -> Turns:
+        """
+        取出用户的对话窗口，不在内存中时从文件加载，并按LRU淘汰。
+        """
+        turns = self._users.get(user_id)
+        if turns is not None:
+            self._users.move_to_end(user_id)
+            return turns
+        turns = Turns(self._load(user_id), self.max_turns, self.max_tokens)
+        self._users[user_id] = turns
+        while len(self._users) > self.max_users:
+            evicted, evicted_turns = self._users.popitem(last=False)
+            if evicted in self._dirty:
+                self._dirty.discard(evicted)
+                self._write(evicted, list(evicted_turns))
+        return turns
+
+    def _mark_dirty(self, name: str):
+        self._dirty.add(name)
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        将所有未写盘的修改写入文件。
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for name in self._dirty:
+                if name == "public":
+                    self._write(name, list(self._public))
+                else:
+                    self._write(name, list(self._users[name]))
+            self._dirty.clear()
+
+    def read(self, user_id: str) -> tuple:
+        """
+        读取用户的对话记录。
+        return: 对话记录列表,对话记录是否已满
+        """
+        with self._lock:
+            turns = self._get(user_id)
+            return list(turns), turns.full
+
+    def record(self, user_id: str, user_msg: str, bot_msg: str):
+        """
+        追加一轮对话，超出轮数或token上限时丢弃最旧的。
+        """
+        with self._lock:
+            self._get(user_id).add(make_turn(user_msg, bot_msg))
+            self._mark_dirty(user_id)
+
+    def compact(self, user_id: str, old: list, turn: list) -> bool:
+        """
+        用一轮对话(如摘要)替换窗口开头的若干轮。
+        生成摘要期间新的对话可能已把其中最旧的几轮挤出窗口，只要old的剩余部分仍在窗口开头就替换这部分。
+        param old: 被替换的对话，读取时窗口开头的若干轮
+        param turn: 替换后的一轮对话，带token数
+        return: 是否已替换，对话记录已被清空或改变时为False
+        """
+        with self._lock:
+            turns = self._get(user_id)
+            current = list(turns)
+            for start in range(len(old)):
+                tail = old[start:]
+                if current[: len(tail)] == tail:
+                    break
+            else:
+                return False
+            turns = Turns(
+                [turn] + current[len(tail) :], self.max_turns, self.max_tokens
+            )
+            self._users[user_id] = turns
+            self._replace(user_id, turns)
+            return True
+
+    def _replace(self, name: str, turns: Turns):
+        """
+        持久化整体替换后的对话窗口。
+        """
+        self._mark_dirty(name)
+
+    def delete(self, user_id: str):
+        """
+        删除用户的对话记录。
+        """
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._dirty.discard(user_id)
+            try:
+                os.remove(self._path(user_id))
+            except OSError:
+                pass
+
+    def _get_public(self) -> Turns:
+        """
+        取出公共对话记录，只在首次读取或失效后加载文件。
+        """
+        if self._public is None:
+            self._public = Turns(self._load("public"), self.max_public_turns)
+        return self._public
+
+    def read_public(self) -> list:
+        """
+        读取公共对话记录。
+        """
+        with self._lock:
+            return list(self._get_public())
+
+    def window(self, user_id: str, budget: int, margin: int = 0) -> tuple:
+        """
+        组装token数不超过budget的上下文：先放入最新的公共对话记录(机器人预设)，剩余预算再放入用户最新的对话。
+        param user_id: 用户ID
+        param budget: token预算
+        param margin: 对话记录距离上限不足margin轮时即视为已满，见Turns.near_full
+        return: 上下文列表,是否有对话因轮数或预算被舍弃(或即将被舍弃)
+        """
+        with self._lock:
+            public = self._get_public().newest(budget)
+            budget -= sum(turn[2] for turn in public)
+            turns = self._get(user_id)
+            personal = turns.newest(budget)
+            full = turns.near_full(margin) or len(personal) < len(turns)
+            return public + personal, full
+
+    def add_public(self, context: list):
+        """
+        添加一轮公共对话记录。
+        """
+        with self._lock:
+            self._get_public().add(context)
+            self._mark_dirty("public")
+
+    def delete_public(self):
+        """
+        删除公共对话记录。
+        """
+        with self._lock:
+            self._public = Turns(maxlen=self.max_public_turns)
+            self._dirty.discard("public")
+            try:
+                os.remove(self._path("public"))
+            except OSError:
+                pass
+
+
+class LogContextStore(ContextStore):
+    """
+    追加写日志的对话记录存储。
+    每轮对话作为一行JSON追加到 contexts/<user_id>.jsonl，写入只追加不重写，进程崩溃最多丢失最后一行；
+    文件行数超过窗口的compact_ratio倍时压缩为最近一个窗口。加载时只读取文件末尾。
+    """
+
+    suffix = ".jsonl"
+
+    def __init__(
+        self,
+        folder_path: str = "contexts",
+        max_turns: int = 20,
+        max_public_turns: int = 50,
+        max_users: int = 1024,
+        compact_ratio: int = 2,
+        fsync: bool = False,
+        max_tokens: int = None,
+    ) -> None:
+        """
+        初始化。
+        param folder_path: 对话记录目录
+        param max_turns: 每个用户保留的最大对话轮数
+        param max_public_turns: 公共对话记录保留的最大轮数
+        param max_users: 内存中缓存的用户数上限
+        param compact_ratio: 文件行数超过窗口的多少倍时触发压缩
+        param fsync: 每次追加后是否fsync，开启后断电也不丢数据，但吞吐较低
+        param max_tokens: 每个用户保留的最大token数
+        """
+        super().__init__(
+            folder_path, max_turns, max_public_turns, max_users, max_tokens=max_tokens
+        )
+        self.compact_ratio = compact_ratio
+        self.fsync = fsync
+        self._lines = {}
+        self._torn = set()
+
+    def _window(self, name: str) -> int:
+        return self.max_public_turns if name == "public" else self.max_turns
+
+    def _load(self, name: str) -> list:
+        """
+        从文件末尾向前读取，直到凑够一个窗口的记录。
+        """
+        window = self._window(name)
+        try:
+            with open(self._path(name), "rb") as f:
+                end = f.seek(0, os.SEEK_END)
+                data = b""
+                while end > 0 and data.count(b"\n") <= window:
+                    step = min(4096, end)
+                    end -= step
+                    f.seek(end)
+                    data = f.read(step) + data
+        except OSError:
+            self._lines[name] = 0
+            return []
+        if data and not data.endswith(b"\n"):
+            # 上次崩溃留下了不完整的行，下次追加前先换行
+            self._torn.add(name)
+        lines = data.split(b"\n")
+        if end > 0:
+            # 第一行可能不完整
+            lines = lines[1:]
+        record = []
+        for line in lines:
+            try:
+                turn = json.loads(line)
+            except ValueError:
+                # 空行或崩溃时写了一半的行
+                continue
+            if "t" in turn:
+                record.append([turn["q"], turn["a"], turn["t"]])
+            else:
+                record.append([turn["q"], turn["a"]])
+        record = record[-window:]
+        # 文件前面还有未读取的内容时，下次追加直接触发压缩
+        self._lines[name] = (
+            window * self.compact_ratio if end > 0 else len(lines)
+        )
+        return record
+
+    def _append(self, name: str, turn: list, record: list):
+        """
+        追加一行记录，行数过多时压缩。
+        param turn: 带token数的一轮对话
+        param record: 追加后内存中的完整窗口，用于压缩
+        """
+        line = json.dumps({"q": turn[0], "a": turn[1], "t": turn[2]}) + "\n"
+        if name in self._torn:
+            self._torn.discard(name)
+            line = "\n" + line
+        with open(self._path(name), "a") as f:
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._lines[name] = self._lines.get(name, 0) + 1
+        if self._lines[name] > self._window(name) * self.compact_ratio:
+            self._compact(name, record)
+
+    def _compact(self, name: str, record: list):
+        """
+        用当前窗口原子替换整个日志文件。
+        """
+        path = self._path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder_path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for user_msg, bot_msg, tokens in record:
+                    f.write(json.dumps({"q": user_msg, "a": bot_msg, "t": tokens}) + "\n")
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._lines[name] = len(record)
+        self._torn.discard(name)
+
+    def _replace(self, name: str, turns: Turns):
+        self._compact(name, list(turns))
+
+    def record(self, user_id: str, user_msg: str, bot_msg: str):
+        with self._lock:
+            turns = self._get(user_id)
+            turn = turns.add(make_turn(user_msg, bot_msg))
+            self._append(user_id, turn, turns)
+
+    def delete(self, user_id: str):
+        with self._lock:
+            super().delete(user_id)
+            self._lines.pop(user_id, None)
+            self._torn.discard(user_id)
+
+    def add_public(self, context: list):
+        with self._lock:
+            public = self._get_public()
+            self._append("public", public.add(context), public)
+
+    def delete_public(self):
+        with self._lock:
+            super().delete_public()
+            self._lines.pop("public", None)
+            self._torn.discard("public")
+
+
+class SqliteContextStore(ContextStore):
+    """
+    SQLite对话记录存储，适合用户量大的部署，避免contexts目录下出现大量小文件。
+    使用WAL模式，(user_id, seq)索引，多次写入合并为一次提交(group commit)。
+    """
+
+    def __init__(
+        self,
+        folder_path: str = "contexts",
+        max_turns: int = 20,
+        max_public_turns: int = 50,
+        max_users: int = 1024,
+        db_name: str = "contexts.db",
+        commit_batch: int = 100,
+        commit_delay: float = 0.2,
+        max_tokens: int = None,
+    ) -> None:
+        """
+        初始化。
+        param folder_path: 数据库所在目录
+        param max_turns: 每个用户保留的最大对话轮数
+        param max_public_turns: 公共对话记录保留的最大轮数
+        param max_users: 内存中缓存的用户数上限
+        param db_name: 数据库文件名
+        param commit_batch: 累计多少次写入后立即提交
+        param commit_delay: 未达到commit_batch时，最多延迟多少秒提交
+        param max_tokens: 每个用户保留的最大token数
+        """
+        super().__init__(
+            folder_path, max_turns, max_public_turns, max_users, max_tokens=max_tokens
+        )
+        self.commit_batch = commit_batch
+        self.commit_delay = commit_delay
+        self._seq = {}
+        self._pending = 0
+        os.makedirs(folder_path, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(folder_path, db_name), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "user_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "user_msg TEXT NOT NULL, bot_msg TEXT NOT NULL, tokens INTEGER)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(turns)")]
+        if "tokens" not in columns:
+            # 旧版本创建的表，缺少的token数在加载时补算
+            self._conn.execute("ALTER TABLE turns ADD COLUMN tokens INTEGER")
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_turns_user_seq ON turns (user_id, seq)"
+        )
+        self._conn.commit()
+
+    # 语句保持固定文本，sqlite3会缓存编译后的prepared statement
+    _SELECT = (
+        "SELECT seq, user_msg, bot_msg, tokens FROM turns WHERE user_id = ? "
+        "ORDER BY seq DESC LIMIT ?"
+    )
+    _INSERT = (
+        "INSERT INTO turns (user_id, seq, user_msg, bot_msg, tokens) "
+        "VALUES (?, ?, ?, ?, ?)"
+    )
+    _TRIM = "DELETE FROM turns WHERE user_id = ? AND seq <= ?"
+    _DELETE = "DELETE FROM turns WHERE user_id = ?"
+
+    def _window(self, name: str) -> int:
+        return self.max_public_turns if name == "public" else self.max_turns
+
+    def _load(self, name: str) -> list:
+        rows = self._conn.execute(self._SELECT, (name, self._window(name))).fetchall()
+        self._seq[name] = rows[0][0] if rows else 0
+        return [
+            [user_msg, bot_msg] if tokens is None else [user_msg, bot_msg, tokens]
+            for _, user_msg, bot_msg, tokens in reversed(rows)
+        ]
+
+    def _insert(self, name: str, turn: list):
+        """
+        写入一轮对话并删除窗口之外的旧记录，提交延后合并进行。
+        """
+        if name not in self._seq:
+            row = self._conn.execute(
+                "SELECT MAX(seq) FROM turns WHERE user_id = ?", (name,)
+            ).fetchone()
+            self._seq[name] = row[0] or 0
+        seq = self._seq[name] = self._seq[name] + 1
+        self._conn.execute(self._INSERT, (name, seq, turn[0], turn[1], turn[2]))
+        self._conn.execute(self._TRIM, (name, seq - self._window(name)))
+        self._pending += 1
+        if self._pending >= self.commit_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.commit_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        提交所有未提交的写入。
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending:
+                self._conn.commit()
+                self._pending = 0
+
+    def record(self, user_id: str, user_msg: str, bot_msg: str):
+        with self._lock:
+            self._insert(user_id, self._get(user_id).add(make_turn(user_msg, bot_msg)))
+
+    def _replace(self, name: str, turns: Turns):
+        self._conn.execute(self._DELETE, (name,))
+        self._seq[name] = 0
+        for turn in turns:
+            self._insert(name, turn)
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._seq.pop(user_id, None)
+            self._conn.execute(self._DELETE, (user_id,))
+            self._pending += 1
+            self.flush()
+
+    def add_public(self, context: list):
+        with self._lock:
+            self._insert("public", self._get_public().add(context))
+
+    def delete_public(self):
+        with self._lock:
+            self._public = Turns(maxlen=self.max_public_turns)
+            self._seq.pop("public", None)
+            self._conn.execute(self._DELETE, ("public",))
+            self._pending += 1
+            self.flush()
+
+
+def create_context_store(config: dict = None) -> ContextStore:
+    """
+    按配置创建对话记录存储后端。
+    param config: 配置字典，backend可选json、log、sqlite，其余键作为对应后端的初始化参数，
+        例如 {"backend": "sqlite", "folder_path": "contexts"}
+    """
+    config = dict(config or {})
+    backend = config.pop("backend", "json")
+    backends = {
+        "json": ContextStore,
+        "log": LogContextStore,
+        "sqlite": SqliteContextStore,
+    }
+    if backend not in backends:
+        raise ValueError(f"不支持的对话记录后端: {backend}")
+    return backends[backend](**config)
@@ -0,0 +1,84 @@
+from .utils import time
+from collections import OrderedDict
+import asyncio
+
+
+class DedupCache:
+    """
+    消息去重缓存。
+    流式协议在确认超时时会重投回调，按msgId记录最近处理过的消息，重复的消息不再调用大模型和回复。
+    重复消息到达时首条仍在处理中，则等待首条的结果而不是重新处理；首条处理失败时删除记录，允许重投后重新处理。
+    记录按到达顺序保存，过期和超出容量的记录从最早的一端淘汰，每条消息均摊O(1)。
+    所有操作在事件循环线程中进行，无需加锁。
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 10000) -> None:
+        """
+        初始化。
+        param ttl: 记录保留的秒数，应大于钉钉重投的时间窗口
+        param max_size: 最多保留的记录数
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self._entries = OrderedDict()
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries:
+            expire_at, _ = next(iter(entries.values()))
+            if expire_at > now and len(entries) <= self.max_size:
+                break
+            entries.popitem(last=False)
+
+    async def run(self, key, func, *args, **kwargs):
+        """
+        处理一条消息，同一个key只处理一次。
+        param key: 消息ID，为空时不去重
+        param func: 处理消息的协程函数
+        return: func的返回值，重复的消息返回首条的结果
+        """
+        if key is None:
+            return await func(*args, **kwargs)
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            future = entry[1]
+            if not future.done():
+                self.waits += 1
+            # 等待方被取消时不影响首条的处理
+            return await asyncio.shield(future)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now + self.ttl, future)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            if self._entries.get(key, (None, None))[1] is future:
+                del self._entries[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # 没有等待方时避免"exception was never retrieved"警告
+                future.exception()
+            raise
+        future.set_result(result)
+        return result
+
+    def stats(self) -> dict:
+        """
+        return: 当前记录数、重复消息数(hits)、新消息数(misses)、重复时首条仍在处理中的次数(waits)
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+        }
@@ -0,0 +1,111 @@
+from .utils import time, threading
+from concurrent.futures import Future
+import queue
+
+
+class Dispatcher:
+    """
+    后台发送队列。
+    发送任务按会话键(群ID或用户ID)固定分配给某个工作线程，同一会话的消息严格按提交顺序发出，
+    不同会话的消息由多个工作线程并行发送。调用方提交后立即拿到Future，不必等待钉钉返回。
+    """
+
+    def __init__(self, workers: int = 8, max_depth: int = 1000, block: bool = True) -> None:
+        """
+        初始化。
+        param workers: 工作线程数
+        param max_depth: 每个工作线程的队列长度上限
+        param block: 队列已满时是否阻塞等待，为False时直接抛出queue.Full
+        """
+        self.block = block
+        self._queues = [queue.Queue(maxsize=max_depth) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._metrics = {
+            "sent": 0,
+            "failed": 0,
+            "queue_seconds": 0.0,
+            "queue_seconds_max": 0.0,
+            "send_seconds": 0.0,
+            "send_seconds_max": 0.0,
+        }
+        self._threads = [
+            threading.Thread(
+                target=self._worker, args=(q,), name=f"Dispatcher-{i}", daemon=True
+            )
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key: str, func, *args, **kwargs) -> Future:
+        """
+        提交一个发送任务。
+        param key: 会话键，相同键的任务按提交顺序执行
+        param func: 发送函数
+        return: Future，结果为func的返回值
+        """
+        future = Future()
+        q = self._queues[hash(key) % len(self._queues)]
+        q.put((future, func, args, kwargs, time.monotonic()), block=self.block)
+        return future
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            future, func, args, kwargs, enqueued = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                print(f"后台发送失败: {e}")
+                self._record(started - enqueued, time.monotonic() - started, False)
+                future.set_exception(e)
+            else:
+                self._record(started - enqueued, time.monotonic() - started, True)
+                future.set_result(result)
+
+    def _record(self, queue_seconds: float, send_seconds: float, ok: bool):
+        with self._lock:
+            m = self._metrics
+            m["sent" if ok else "failed"] += 1
+            m["queue_seconds"] += queue_seconds
+            m["queue_seconds_max"] = max(m["queue_seconds_max"], queue_seconds)
+            m["send_seconds"] += send_seconds
+            m["send_seconds_max"] = max(m["send_seconds_max"], send_seconds)
+
+    def depth(self) -> int:
+        """
+        当前排队中的任务数。
+        """
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        """
+        return: 排队数、成功/失败数，以及排队耗时与发送耗时的平均值和最大值(秒)
+        """
+        with self._lock:
+            m = dict(self._metrics)
+        done = m["sent"] + m["failed"]
+        return {
+            "depth": self.depth(),
+            "sent": m["sent"],
+            "failed": m["failed"],
+            "queue_avg": m["queue_seconds"] / done if done else 0.0,
+            "queue_max": m["queue_seconds_max"],
+            "send_avg": m["send_seconds"] / done if done else 0.0,
+            "send_max": m["send_seconds_max"],
+        }
+
+    def close(self, wait: bool = True):
+        """
+        发送完已排队的任务后停止工作线程。
+        """
+        for q in self._queues:
+            q.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -1,29 +1,28 @@
 from .utils import requests,json
+from .Token import TokenManager, get_token_manager
 import dingtalk
 
 class MediaHanler:
-    def __init__(self, client_id: str, client_secret: str) -> None:
+    def __init__(self, client_id: str, client_secret: str, token_manager: TokenManager = None) -> None:
         """
         初始化媒体文件工作台
         Parameters:
             - client_id: 钉钉 API 的 client_id
             - client_secret: 钉钉 API 的 client_secret
+            - token_manager: token管理器，默认使用同一应用共享的实例
         
         """
         self.client_id = client_id
         self.client_secret = client_secret
         if not self.client_id or not self.client_secret:
             raise ValueError("client_id或client_secret未配置")
+        self.token_manager = token_manager or get_token_manager(client_id, client_secret)
         
     def _get_token(self):
         """
-        获取token。
+        获取token，由共享的TokenManager缓存并自动刷新。
         """
-        url = f"https://oapi.dingtalk.com/gettoken?appkey={self.client_id}&appsecret={self.client_secret}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise ValueError("获取token失败")
-        return response.json()["access_token"]
+        return self.token_manager.get_token()
     
 
 class MediaUploader(MediaHanler):
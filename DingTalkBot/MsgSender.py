@@ -1,23 +1,204 @@
-from .utils import requests, json
+from .utils import json
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+from .Token import TokenManager, get_token_manager
+from .RateLimiter import RateLimiter, get_rate_limiter
+from .Dispatcher import Dispatcher
+from .Retry import RetryPolicy, get_retry_policy, check_response
+from .Session import get_session
+from .Template import encode_body, finish_body
+from .Outbox import Outbox
 
 
 class MsgSender:
 
-    def __init__(self, client_id: str, client_secret: str) -> None:
+    # 发件箱中区分发送器的类型
+    kind = None
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        token_manager: TokenManager = None,
+        rate_limiter: RateLimiter = None,
+        dispatcher: Dispatcher = None,
+        retry_policy: RetryPolicy = None,
+        session=None,
+        outbox: Outbox = None,
+    ) -> None:
         self.client_id = client_id
         self.client_secret = client_secret
         if not self.client_id or not self.client_secret:
             raise ValueError("client_id或client_secret未配置")
+        self.token_manager = token_manager or get_token_manager(
+            client_id, client_secret
+        )
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.dispatcher = dispatcher
+        self.retry_policy = retry_policy
+        self.session = session
+        self.outbox = outbox
 
     def get_token(self):
         """
-        获取token。
+        获取token，由共享的TokenManager缓存并自动刷新。
+        """
+        return self.token_manager.get_token()
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        body,
+        error: str,
+        conversation: str = None,
+        params: dict = None,
+        idempotent: bool = None,
+    ) -> dict:
+        """
+        带token、限流和重试地调用钉钉接口。每次尝试都重新取token并经过限流器。
+        param method: HTTP方法
+        param url: 接口地址
+        param body: 请求体，dict或已编码好的JSON bytes
+        param error: 失败时的错误信息
+        param conversation: 群ID，用于按群限流
+        param params: URL查询参数
+        param idempotent: 请求是否幂等，默认POST(发送消息)为非幂等，非幂等请求只在服务端确定未处理时重试
+        return: 响应的json
+        """
+        if idempotent is None:
+            idempotent = method != "POST"
+        policy = self.retry_policy or get_retry_policy()
+        return policy.call(
+            self._request_once,
+            method,
+            url,
+            body,
+            error,
+            conversation,
+            params,
+            idempotent=idempotent,
+        )
+
+    def _request_once(self, method, url, body, error, conversation, params):
+        headers = {"x-acs-dingtalk-access-token": self.get_token()}
+        self.rate_limiter.acquire(
+            robot_code=self.client_id, endpoint=url, conversation=conversation
+        )
+        session = self.session or get_session()
+        if isinstance(body, bytes):
+            headers["Content-Type"] = "application/json"
+            response = session.request(
+                method, url, headers=headers, params=params, data=body
+            )
+        else:
+            response = session.request(
+                method, url, headers=headers, params=params, json=body
+            )
+        check_response(response, error)
+        return response.json()
+
+    def _encode(self, msg_key: str, msgParam: dict) -> bytes:
+        """
+        按消息模板编码请求体中除接收者以外的部分，见encode_body。
+        """
+        return encode_body(msg_key, msgParam, self.client_id)
+
+    def _dispatch(self, key: str, func, *args):
+        """
+        配置了dispatcher时交给后台队列发送并返回Future，否则直接发送并返回结果。
+        param key: 会话键，同一会话的消息按顺序发送
+        """
+        if self.dispatcher is None:
+            return func(*args)
+        return self.dispatcher.submit(key, func, *args)
+
+    def _key(self, target) -> str:
+        """
+        接收者对应的会话键。
+        """
+        return target
+
+    def _send(self, partial: bytes, target):
+        """
+        发送编码好的消息。配置了发件箱时先落盘再交给dispatcher，发送成功后确认。
+        param partial: _encode编码好的消息
+        param target: 接收者
+        """
+        if self.outbox is None:
+            return self._dispatch(self._key(target), self._post_msg, partial, target)
+        msg_id = self.outbox.put(self.kind, self.client_id, target, partial)
+        return self._dispatch(self._key(target), self._deliver, msg_id, partial, target)
+
+    def _post(self, partial: bytes, target):
+        """
+        _send的同步版本，供群发使用。
+        """
+        if self.outbox is None:
+            return self._post_msg(partial, target)
+        msg_id = self.outbox.put(self.kind, self.client_id, target, partial)
+        return self._deliver(msg_id, partial, target)
+
+    def _deliver(self, msg_id: str, partial: bytes, target):
+        """
+        发送发件箱中的一条消息，并记录结果。重试策略判定为不可重试的错误直接移入死信文件，
+        其中包括读超时等无法确定服务端是否已经收到的错误，以免重发出重复消息。
+        """
+        try:
+            result = self._post_msg(partial, target)
+        except Exception as e:
+            policy = self.retry_policy or get_retry_policy()
+            self.outbox.fail(
+                msg_id, e, permanent=not policy.retryable(e, idempotent=False)
+            )
+            raise
+        self.outbox.ack(msg_id)
+        return result
+
+    def replay(self) -> int:
+        """
+        重发发件箱中属于本发送器、未确认且已过退避时间的消息，启动时调用，运行期间定期调用以重试失败的消息。
+        return: 已交给dispatcher(或已直接发送)的消息数
+        """
+        if self.outbox is None:
+            return 0
+        count = 0
+        for msg_id, target, partial in self.outbox.pending(self.kind, self.client_id):
+            if self.dispatcher is None:
+                try:
+                    self._deliver(msg_id, partial, target)
+                except Exception as e:
+                    # 失败已由_deliver记入发件箱
+                    print(f"重发消息失败: {e}")
+            else:
+                try:
+                    self.dispatcher.submit(
+                        self._key(target), self._deliver, msg_id, partial, target
+                    )
+                except Exception as e:
+                    # 未能交给发送队列(如队列已满)，取消发送中标记，下次重发时再取出
+                    self.outbox.release(msg_id)
+                    print(f"重发消息失败: {e!r}")
+                    continue
+            count += 1
+        return count
+
+    def _fan_out(self, jobs: dict, max_workers: int) -> dict:
+        """
+        并发执行多个发送任务。
+        param jobs: {任务键: 无参发送函数}
+        param max_workers: 最大并发数
+        return: {任务键: processQueryKey，发送失败时为对应的异常}
         """
-        url = f"https://oapi.dingtalk.com/gettoken?appkey={self.client_id}&appsecret={self.client_secret}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise ValueError("获取token失败")
-        return response.json()["access_token"]
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {key: pool.submit(job) for key, job in jobs.items()}
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = e
+        return results
 
 
 class PatchSender(MsgSender):
@@ -26,8 +207,29 @@ class PatchSender(MsgSender):
     [官方文档](https://open.dingtalk.com/document/orgapp/types-of-messages-sent-by-robots?spm=ding_open_doc.document.0.0.1b7d25bcVXddBZ)
     """
 
-    def __init__(self, client_id: str, client_secret: str) -> None:
-        super().__init__(client_id, client_secret)
+    kind = "patch"
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        token_manager: TokenManager = None,
+        rate_limiter: RateLimiter = None,
+        dispatcher: Dispatcher = None,
+        retry_policy: RetryPolicy = None,
+        session=None,
+        outbox: Outbox = None,
+    ) -> None:
+        super().__init__(
+            client_id,
+            client_secret,
+            token_manager,
+            rate_limiter,
+            dispatcher,
+            retry_policy,
+            session,
+            outbox,
+        )
         self.api = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
 
     def _send_msg(self, msg_key: str, msgParam: dict, user_ids: list = []):
@@ -36,21 +238,92 @@ class PatchSender(MsgSender):
         param msg_key: 消息类型。
         param msgParam: 消息参数。
         param user_ids: 用户ID列表，默认为空。
+        return: 返回此发送出消息的加密ID，配置了dispatcher时返回其Future。
+        """
+        return self._send(self._encode(msg_key, msgParam), user_ids)
+
+    def _key(self, user_ids: list) -> str:
+        return ",".join(user_ids)
+
+    def _post_msg(self, partial: bytes, user_ids: list):
+        """
+        调用接口发送消息。
+        param partial: _encode编码好的消息
+        param user_ids: 用户ID列表
         return: 返回此发送出消息的加密ID。
         """
-        token = self.get_token()
-        headers = {"x-acs-dingtalk-access-token": token}
-        body = {
-            "msgParam": str(msgParam),
-            "msgKey": msg_key,
-            "robotCode": self.client_id,
-            "userIds": user_ids,
+        body = finish_body(partial, "userIds", user_ids)
+        return self._request("POST", self.api, body, "发送消息失败")["processQueryKey"]
+
+    def broadcast(
+        self,
+        msg_key: str,
+        msgParam: dict,
+        user_ids: list,
+        chunk_size: int = 20,
+        max_workers: int = 8,
+    ) -> dict:
+        """
+        向任意数量的用户群发消息：去重后按单次请求上限分批，并发发送。
+        消息只编码一次，各批次复用编码结果。
+        param msg_key: 消息类型。
+        param msgParam: 消息参数。
+        param user_ids: 用户ID列表，可以超过单次请求上限。
+        param chunk_size: 每批的用户数，batchSend单次最多20个。
+        param max_workers: 最大并发请求数。
+        return: {用户ID: 所在批次的processQueryKey，发送失败时为对应的异常}
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        chunks = [
+            user_ids[i : i + chunk_size] for i in range(0, len(user_ids), chunk_size)
+        ]
+        partial = self._encode(msg_key, msgParam)
+        jobs = {
+            index: (lambda chunk=chunk: self._post(partial, chunk))
+            for index, chunk in enumerate(chunks)
         }
-        response = requests.post(self.api, headers=headers, json=body)
-        if response.status_code != 200:
-            print(response.json())
-            raise ValueError("发送消息失败")
-        return response.json()["processQueryKey"]
+        batch_results = self._fan_out(jobs, max_workers)
+        return {
+            user_id: batch_results[index]
+            for index, chunk in enumerate(chunks)
+            for user_id in chunk
+        }
+
+    def query_read_status(self, processQueryKey: str) -> dict:
+        """
+        查询单聊消息的发送状态和已读情况。
+        param processQueryKey: 发送消息时返回的加密ID
+        return: {"sendStatus": ..., "messageReadInfoList": [{"userId", "readStatus", ...}]}
+        """
+        return self._request(
+            "GET",
+            "https://api.dingtalk.com/v1.0/robot/oToMessages/readStatus",
+            None,
+            "查询消息已读状态失败",
+            params={"robotCode": self.client_id, "processQueryKey": processQueryKey},
+        )
+
+    def broadcast_text(self, content: str, user_ids: list, **kwargs) -> dict:
+        """
+        群发文本消息。
+        param content: 文本内容。
+        param user_ids: 用户ID列表。
+        其余参数见broadcast。
+        """
+        return self.broadcast("sampleText", {"content": content}, user_ids, **kwargs)
+
+    def broadcast_markdown(
+        self, title: str, content: str, user_ids: list, **kwargs
+    ) -> dict:
+        """
+        群发markdown消息。
+        param title: 标题
+        param content: 内容
+        param user_ids: 用户ID列表。
+        其余参数见broadcast。
+        """
+        msgParam = {"title": title, "text": content}
+        return self.broadcast("sampleMarkdown", msgParam, user_ids, **kwargs)
 
     def send_text(self, content: str, user_ids: list = []):
         """
@@ -368,13 +641,40 @@ class PatchSender(MsgSender):
 
 class GroupSender(MsgSender):
 
-    def __init__(self, client_id: str, client_secret: str) -> None:
+    kind = "group"
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        token_manager: TokenManager = None,
+        rate_limiter: RateLimiter = None,
+        dispatcher: Dispatcher = None,
+        retry_policy: RetryPolicy = None,
+        session=None,
+        outbox: Outbox = None,
+    ) -> None:
         """
         初始化。
         param client_id: 客户端ID。
         param client_secret: 客户端密钥。
+        param token_manager: token管理器，默认使用同一应用共享的实例。
+        param rate_limiter: 限流器，默认使用进程内共享的实例。
+        param dispatcher: 后台发送队列，配置后send_*立即返回Future。
+        param retry_policy: 重试策略，默认使用进程内共享的实例。
+        param session: HTTP会话，默认使用进程内共享的连接池，见create_session。
+        param outbox: 持久化发件箱，配置后消息先落盘再发送，重启后可重发。
         """
-        super().__init__(client_id, client_secret)
+        super().__init__(
+            client_id,
+            client_secret,
+            token_manager,
+            rate_limiter,
+            dispatcher,
+            retry_policy,
+            session,
+            outbox,
+        )
         self.api = "https://api.dingtalk.com/v1.0/robot/groupMessages/send"
 
     def _send_msg(self, msg_key: str, msgParam: dict, openConversationId: str):
@@ -383,21 +683,100 @@ class GroupSender(MsgSender):
         param msg_key: 消息类型。
         param msgParam: 消息参数。
         param openConversationId: 群ID。
+        return: 返回此发送出消息的加密ID，配置了dispatcher时返回其Future。
+        """
+        return self._send(self._encode(msg_key, msgParam), openConversationId)
+
+    def _post_msg(self, partial: bytes, openConversationId: str):
+        """
+        调用接口发送消息。
+        param partial: _encode编码好的消息
+        param openConversationId: 群ID
         return: 返回此发送出消息的加密ID。
         """
-        token = self.get_token()
-        headers = {"x-acs-dingtalk-access-token": token}
+        body = finish_body(partial, "openConversationId", openConversationId)
+        result = self._request(
+            "POST", self.api, body, "发送消息失败", conversation=openConversationId
+        )
+        return result["processQueryKey"]
+
+    def broadcast(
+        self,
+        msg_key: str,
+        msgParam: dict,
+        openConversationIds: list,
+        max_workers: int = 8,
+    ) -> dict:
+        """
+        向多个群并发发送同一条消息，消息只编码一次。
+        param msg_key: 消息类型。
+        param msgParam: 消息参数。
+        param openConversationIds: 群ID列表，重复的群只发送一次。
+        param max_workers: 最大并发请求数。
+        return: {群ID: processQueryKey，发送失败时为对应的异常}
+        """
+        partial = self._encode(msg_key, msgParam)
+        jobs = {
+            conversation_id: (
+                lambda conversation_id=conversation_id: self._post(
+                    partial, conversation_id
+                )
+            )
+            for conversation_id in dict.fromkeys(openConversationIds)
+        }
+        return self._fan_out(jobs, max_workers)
+
+    def query_read_status(self, openConversationId: str, processQueryKey: str) -> dict:
+        """
+        查询群消息的已读情况，自动翻页汇总已读用户。
+        param openConversationId: 群ID
+        param processQueryKey: 发送消息时返回的加密ID
+        return: {"sendStatus": ..., "readUserIds": [...]}
+        """
         body = {
-            "msgParam": str(msgParam),
-            "msgKey": msg_key,
-            "robotCode": self.client_id,
             "openConversationId": openConversationId,
+            "robotCode": self.client_id,
+            "processQueryKey": processQueryKey,
+            "maxResults": 100,
         }
-        response = requests.post(self.api, headers=headers, json=body)
-        if response.status_code != 200:
-            print(response.json())
-            raise ValueError("发送消息失败")
-        return response.json()["processQueryKey"]
+        read_user_ids = []
+        while True:
+            data = self._request(
+                "POST",
+                "https://api.dingtalk.com/v1.0/robot/groupMessages/query",
+                body,
+                "查询消息已读状态失败",
+                idempotent=True,
+            )
+            read_user_ids.extend(data.get("readUserIds", []))
+            if not data.get("nextToken"):
+                break
+            body = {**body, "nextToken": data["nextToken"]}
+        return {"sendStatus": data.get("sendStatus"), "readUserIds": read_user_ids}
+
+    def broadcast_text(self, content: str, openConversationIds: list, **kwargs) -> dict:
+        """
+        向多个群发送文本消息。
+        param content: 文本内容。
+        param openConversationIds: 群ID列表。
+        其余参数见broadcast。
+        """
+        return self.broadcast(
+            "sampleText", {"content": content}, openConversationIds, **kwargs
+        )
+
+    def broadcast_markdown(
+        self, title: str, content: str, openConversationIds: list, **kwargs
+    ) -> dict:
+        """
+        向多个群发送markdown消息。
+        param title: 标题
+        param content: 内容
+        param openConversationIds: 群ID列表。
+        其余参数见broadcast。
+        """
+        msgParam = {"title": title, "text": content}
+        return self.broadcast("sampleMarkdown", msgParam, openConversationIds, **kwargs)
 
     def send_text(self, content: str, openConversationId: str):
         """
@@ -713,6 +1092,105 @@ class GroupSender(MsgSender):
         return self._send_msg("sampleVideo", msgParam, openConversationId)
 
 
+class CardSender(MsgSender):
+    """
+    可更新的互动卡片消息，用于流式输出等需要持续修改内容的场景。
+    [官方文档](https://open.dingtalk.com/document/orgapp/send-interactive-dynamic-cards-1)
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        token_manager: TokenManager = None,
+        rate_limiter: RateLimiter = None,
+        retry_policy: RetryPolicy = None,
+        session=None,
+    ) -> None:
+        """
+        初始化。卡片发送后需要立即拿到outTrackId用于更新，因此不经过后台发送队列。
+        param client_id: 客户端ID。
+        param client_secret: 客户端密钥。
+        param token_manager: token管理器，默认使用同一应用共享的实例。
+        param rate_limiter: 限流器，默认使用进程内共享的实例。
+        param retry_policy: 重试策略，默认使用进程内共享的实例。
+        param session: HTTP会话，默认使用进程内共享的连接池，见create_session。
+        """
+        super().__init__(
+            client_id,
+            client_secret,
+            token_manager,
+            rate_limiter,
+            None,
+            retry_policy,
+            session,
+        )
+        self.api = "https://api.dingtalk.com/v1.0/im/interactiveCards"
+
+    def _card_data(self, title: str, content: str) -> str:
+        """
+        StandardCard模板的卡片内容：标题+一段markdown。
+        """
+        return json.dumps(
+            {
+                "config": {"autoLayout": True, "enableForward": True},
+                "header": {"title": {"type": "text", "text": title}},
+                "contents": [{"type": "markdown", "text": content, "id": "markdown"}],
+            }
+        )
+
+    def send_markdown_card(
+        self,
+        title: str,
+        content: str,
+        openConversationId: str = None,
+        user_id: str = None,
+    ) -> str:
+        """
+        发送markdown卡片，群聊传openConversationId，单聊传user_id。
+        param title: 标题
+        param content: 内容
+        param openConversationId: 群ID
+        param user_id: 单聊接收者的用户ID
+        return: 卡片的outTrackId，用于后续更新。
+        """
+        out_track_id = uuid.uuid4().hex
+        body = {
+            "cardTemplateId": "StandardCard",
+            "outTrackId": out_track_id,
+            "robotCode": self.client_id,
+            "cardData": self._card_data(title, content),
+        }
+        if openConversationId:
+            body["conversationType"] = 1
+            body["openConversationId"] = openConversationId
+        else:
+            body["conversationType"] = 0
+            body["singleChatReceiver"] = json.dumps({"userId": user_id})
+        self._request(
+            "POST",
+            self.api + "/send",
+            body,
+            "发送卡片失败",
+            conversation=openConversationId,
+        )
+        return out_track_id
+
+    def update_markdown_card(self, outTrackId: str, title: str, content: str):
+        """
+        更新已发送的markdown卡片内容。
+        param outTrackId: send_markdown_card返回的ID
+        param title: 标题
+        param content: 新的内容
+        """
+        body = {
+            "outTrackId": outTrackId,
+            "cardData": self._card_data(title, content),
+            "cardOptions": {"updateCardDataByKey": False},
+        }
+        self._request("PUT", self.api, body, "更新卡片失败")
+
+
 if __name__ == "__main__":
 
     with open("config.json", "r") as f:
@@ -0,0 +1,415 @@
+from .utils import json, os, threading, time
+import atexit
+import sqlite3
+import tempfile
+import uuid
+
+
+class Outbox:
+    """
+    持久化发件箱。
+    消息先写入磁盘再发送，发送成功后确认；进程崩溃后重启时重发未确认的消息，保证至少送达一次。
+    以追加写日志实现：outbox.log每行一条put/fail/ack记录，已确认的记录过多时压缩。
+    并发写入合并为一次写盘和fsync(group commit)：写盘期间到达的写入排入下一批，由下一个线程一次写完。
+    发送失败的消息按指数退避等待后可再次取出重发(见pending)，多次发送失败的消息移入dead.jsonl，不再重发。
+    """
+
+    def __init__(
+        self,
+        folder_path: str = "outbox",
+        max_attempts: int = 5,
+        fsync: bool = True,
+        compact_min: int = 1000,
+        retry_delay: float = 5,
+        max_retry_delay: float = 300,
+    ) -> None:
+        """
+        初始化，并加载上次未确认的消息。
+        param folder_path: 发件箱目录
+        param max_attempts: 发送失败多少次后移入死信文件
+        param fsync: 每批写入后是否fsync，关闭后只能保证进程崩溃不丢消息，断电仍可能丢失
+        param compact_min: 已确认的记录超过该值且多于未确认消息时压缩日志
+        param retry_delay: 第一次发送失败后等待多少秒才能重发，之后每次失败翻倍
+        param max_retry_delay: 重发等待时间的上限(秒)
+        """
+        self.folder_path = folder_path
+        self.max_attempts = max_attempts
+        self.fsync = fsync
+        self.compact_min = compact_min
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        os.makedirs(folder_path, exist_ok=True)
+        self._pending = {}
+        self._inflight = set()
+        # 失败消息最早可重发的时间，只保存在内存中，重启后立即重发
+        self._retry_at = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._batch = _Batch()
+        self._writing = False
+        self._timer = None
+        self.puts = 0
+        self.acked = 0
+        self.dead = 0
+        self.commits = 0
+        self._open()
+        atexit.register(self.flush)
+
+    # ===== 存储 =====
+
+    def _open(self):
+        self._path = os.path.join(self.folder_path, "outbox.log")
+        self._garbage = 0
+        try:
+            with open(self._path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        for line in data.split(b"\n"):
+            try:
+                op = json.loads(line)
+            except ValueError:
+                # 空行或崩溃时写了一半的行
+                continue
+            self._apply(op)
+        # 崩溃时最后一行没写完，下次追加前先换行
+        torn = bool(data) and not data.endswith(b"\n")
+        self._file = open(self._path, "ab")
+        if torn:
+            self._file.write(b"\n")
+
+    def _apply(self, op: dict):
+        """
+        把一条日志记录应用到内存中的未确认消息。
+        """
+        if op["op"] == "put":
+            self._pending[op["id"]] = op
+        elif op["op"] == "fail":
+            record = self._pending.get(op["id"])
+            if record is not None:
+                record["attempts"] = op["attempts"]
+            self._garbage += 1
+        else:
+            self._pending.pop(op["id"], None)
+            self._garbage += 1
+
+    def _write(self, ops: list):
+        """
+        写入一批记录，返回前已落盘。
+        """
+        self._file.write(
+            b"".join(json.dumps(op, ensure_ascii=False).encode() + b"\n" for op in ops)
+        )
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._garbage += sum(op["op"] != "put" for op in ops)
+        if self._garbage > self.compact_min and self._garbage > len(self._pending):
+            self._compact()
+
+    def _compact(self):
+        """
+        只保留未确认的消息，原子替换日志文件。
+        """
+        with self._lock:
+            records = [dict(record) for record in self._pending.values()]
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder_path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            self._file = open(self._path, "ab")
+        self._garbage = 0
+
+    # ===== group commit =====
+
+    def _submit(self, op: dict, wait: bool):
+        """
+        把一条记录加入当前批次。
+        param wait: 是否等待该批次落盘
+        """
+        with self._cond:
+            batch = self._batch
+            batch.append(op)
+            if not wait:
+                if self._timer is None:
+                    self._timer = threading.Timer(0.05, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        """
+        等待batch落盘，没有线程在写盘时由当前线程写入当前积累的整批记录。须持有锁。
+        """
+        while not batch.done:
+            if self._writing:
+                self._cond.wait()
+                continue
+            ops, self._batch = self._batch, _Batch()
+            self._writing = True
+            self._cond.release()
+            error = None
+            try:
+                if ops:
+                    self._write(ops)
+            except Exception as e:
+                error = e
+            finally:
+                self._cond.acquire()
+                self._writing = False
+                self.commits += 1
+                ops.done = True
+                ops.error = error
+                self._cond.notify_all()
+        if batch.error is not None:
+            raise batch.error
+
+    def flush(self):
+        """
+        立即写入所有尚未落盘的记录。
+        """
+        with self._cond:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._batch:
+                self._commit(self._batch)
+
+    # ===== 发件箱接口 =====
+
+    def put(self, kind: str, robot: str, target, body: bytes) -> str:
+        """
+        写入一条待发送的消息，返回时已落盘。
+        param kind: 发送器类型，patch或group
+        param robot: 机器人编码
+        param target: 接收者，用户ID列表或群ID
+        param body: 编码好的消息
+        return: 消息ID
+        """
+        msg_id = uuid.uuid4().hex
+        op = {
+            "op": "put",
+            "id": msg_id,
+            "kind": kind,
+            "robot": robot,
+            "target": target,
+            "body": body.decode(),
+            "attempts": 0,
+        }
+        with self._lock:
+            self._pending[msg_id] = op
+            self._inflight.add(msg_id)
+            self.puts += 1
+        self._submit(op, wait=True)
+        return msg_id
+
+    def ack(self, msg_id: str):
+        """
+        确认消息已发送。确认记录随下一批写入，崩溃时丢失确认只会导致重发。
+        """
+        with self._lock:
+            self._pending.pop(msg_id, None)
+            self._inflight.discard(msg_id)
+            self._retry_at.pop(msg_id, None)
+            self.acked += 1
+        self._submit({"op": "ack", "id": msg_id}, wait=False)
+
+    def fail(self, msg_id: str, error: Exception, permanent: bool = False) -> bool:
+        """
+        记录一次发送失败，失败次数达到max_attempts时移入死信文件，否则退避一段时间后可由pending再次取出。
+        param permanent: 是否为重发也不会成功的错误(如参数错误)，是则直接移入死信文件
+        return: 是否已移入死信文件
+        """
+        with self._lock:
+            self._inflight.discard(msg_id)
+            record = self._pending.get(msg_id)
+            if record is None:
+                return False
+            record["attempts"] += 1
+            dead = permanent or record["attempts"] >= self.max_attempts
+            if dead:
+                del self._pending[msg_id]
+                self._retry_at.pop(msg_id, None)
+                self.dead += 1
+            else:
+                delay = self.retry_delay * 2 ** (record["attempts"] - 1)
+                self._retry_at[msg_id] = time.monotonic() + min(
+                    delay, self.max_retry_delay
+                )
+        if not dead:
+            self._submit(
+                {"op": "fail", "id": msg_id, "attempts": record["attempts"]}, wait=False
+            )
+            return False
+        letter = dict(record, error=str(error), time=time.time())
+        letter.pop("op")
+        with open(os.path.join(self.folder_path, "dead.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(letter, ensure_ascii=False) + "\n")
+        self._submit({"op": "ack", "id": msg_id}, wait=False)
+        return True
+
+    def release(self, msg_id: str):
+        """
+        取消消息的发送中标记而不计入失败次数，用于pending取出后未能交给发送队列的消息，下次pending时再取出。
+        """
+        with self._lock:
+            self._inflight.discard(msg_id)
+
+    def pending(self, kind: str = None, robot: str = None) -> list:
+        """
+        取出未确认、不在发送中且已过退避时间的消息用于重发，取出的消息标记为发送中。
+        param kind: 只取该类型的消息
+        param robot: 只取该机器人的消息
+        return: [(消息ID, 接收者, 编码好的消息)]
+        """
+        now = time.monotonic()
+        with self._lock:
+            records = [
+                record
+                for msg_id, record in self._pending.items()
+                if msg_id not in self._inflight
+                and self._retry_at.get(msg_id, 0) <= now
+                and (kind is None or record["kind"] == kind)
+                and (robot is None or record["robot"] == robot)
+            ]
+            self._inflight.update(record["id"] for record in records)
+        return [
+            (record["id"], record["target"], record["body"].encode())
+            for record in records
+        ]
+
+    def stats(self) -> dict:
+        """
+        return: 未确认数、累计写入/确认/死信数，以及写盘次数(小于写入数说明发生了合并提交)
+        """
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "puts": self.puts,
+                "acked": self.acked,
+                "dead": self.dead,
+                "commits": self.commits,
+            }
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class _Batch(list):
+    """
+    一批待写入的记录，写完后done置为True，error为写入时的异常。
+    """
+
+    done = False
+    error = None
+
+
+class SqliteOutbox(Outbox):
+    """
+    SQLite发件箱，消息保存在outbox表中，确认即删除。同样采用group commit，一批写入只提交一次。
+    """
+
+    def __init__(
+        self,
+        folder_path: str = "outbox",
+        max_attempts: int = 5,
+        fsync: bool = True,
+        db_name: str = "outbox.db",
+        retry_delay: float = 5,
+        max_retry_delay: float = 300,
+    ) -> None:
+        """
+        初始化。
+        param db_name: 数据库文件名
+        其余参数见Outbox。
+        """
+        self.db_name = db_name
+        super().__init__(
+            folder_path,
+            max_attempts,
+            fsync,
+            retry_delay=retry_delay,
+            max_retry_delay=max_retry_delay,
+        )
+
+    _PUT = (
+        "INSERT INTO outbox (id, kind, robot, target, body, attempts) "
+        "VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    _FAIL = "UPDATE outbox SET attempts = ? WHERE id = ?"
+    _ACK = "DELETE FROM outbox WHERE id = ?"
+
+    def _open(self):
+        self._conn = sqlite3.connect(
+            os.path.join(self.folder_path, self.db_name), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL下NORMAL只保证进程崩溃不丢数据，FULL每次提交都fsync
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, robot TEXT NOT NULL, "
+            "target TEXT NOT NULL, body TEXT NOT NULL, attempts INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        for msg_id, kind, robot, target, body, attempts in self._conn.execute(
+            "SELECT id, kind, robot, target, body, attempts FROM outbox"
+        ):
+            self._pending[msg_id] = {
+                "op": "put",
+                "id": msg_id,
+                "kind": kind,
+                "robot": robot,
+                "target": json.loads(target),
+                "body": body,
+                "attempts": attempts,
+            }
+
+    def _write(self, ops: list):
+        for op in ops:
+            if op["op"] == "put":
+                self._conn.execute(
+                    self._PUT,
+                    (
+                        op["id"],
+                        op["kind"],
+                        op["robot"],
+                        json.dumps(op["target"]),
+                        op["body"],
+                        op["attempts"],
+                    ),
+                )
+            elif op["op"] == "fail":
+                self._conn.execute(self._FAIL, (op["attempts"], op["id"]))
+            else:
+                self._conn.execute(self._ACK, (op["id"],))
+        self._conn.commit()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+def create_outbox(config: dict = None) -> Outbox:
+    """
+    根据配置创建发件箱。
+    param config: 如{"backend": "log", "folder_path": "outbox"}，backend可选log或sqlite，其余参数传给对应类
+    """
+    config = dict(config or {})
+    backend = config.pop("backend", "log")
+    if backend == "log":
+        return Outbox(**config)
+    if backend == "sqlite":
+        return SqliteOutbox(**config)
+    raise ValueError(f"不支持的发件箱后端: {backend}")
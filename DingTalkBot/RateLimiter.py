@@ -0,0 +1,155 @@
+from .utils import time, threading
+import asyncio
+
+
+class TokenBucket:
+    """
+    令牌桶。令牌不足时允许透支，透支量即排在前面的请求数，据此算出需要等待的时间，
+    因此等待的请求按先来后到依次放行，不需要轮询。
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        """
+        初始化。
+        param rate: 每秒补充的令牌数
+        param capacity: 桶容量，即允许的突发量，默认等于rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """
+        预占一个令牌。
+        return: 需要等待的秒数，0表示可以立即发送
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def idle(self, now: float) -> bool:
+        """
+        桶已回满，删除后重建不影响限流效果。
+        """
+        return self.tokens + (now - self.last) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    按机器人(robotCode)、接口地址、群(openConversationId)三个维度限流的令牌桶。
+    超出频率的请求排队等待而不是失败，可通过stats查看排队情况。
+    """
+
+    def __init__(
+        self,
+        app_rate: float = 20,
+        endpoint_rate: float = 20,
+        conversation_rate: float = 20 / 60,
+        conversation_burst: float = 20,
+        max_buckets: int = 10000,
+    ) -> None:
+        """
+        初始化。
+        param app_rate: 每个机器人每秒最多请求数
+        param endpoint_rate: 每个接口每秒最多请求数
+        param conversation_rate: 每个群每秒最多消息数，钉钉限制为每分钟20条
+        param conversation_burst: 每个群允许的突发消息数
+        param max_buckets: 令牌桶数量超过该值时清理已回满的桶
+        """
+        self.limits = {
+            "app": (app_rate, None),
+            "endpoint": (endpoint_rate, None),
+            "conversation": (conversation_rate, conversation_burst),
+        }
+        self.max_buckets = max_buckets
+        self.waiting = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, robot_code: str, endpoint: str, conversation: str) -> float:
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for kind, key in (
+                ("app", robot_code),
+                ("endpoint", endpoint),
+                ("conversation", conversation),
+            ):
+                if not key:
+                    continue
+                bucket = self._buckets.get((kind, key))
+                if bucket is None:
+                    bucket = self._buckets[(kind, key)] = TokenBucket(*self.limits[kind])
+                wait = max(wait, bucket.reserve(now))
+            if len(self._buckets) > self.max_buckets:
+                self._buckets = {
+                    k: b for k, b in self._buckets.items() if not b.idle(now)
+                }
+            if wait > 0:
+                self.waiting += 1
+                self.delayed += 1
+                self.wait_seconds += wait
+        return wait
+
+    def _done(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(
+        self, robot_code: str = None, endpoint: str = None, conversation: str = None
+    ) -> float:
+        """
+        获取发送许可，超出频率时阻塞等待。
+        param robot_code: 机器人编码，即client_id
+        param endpoint: 接口地址
+        param conversation: 群ID
+        return: 实际等待的秒数
+        """
+        wait = self._reserve(robot_code, endpoint, conversation)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done()
+        return wait
+
+    async def acquire_async(
+        self, robot_code: str = None, endpoint: str = None, conversation: str = None
+    ) -> float:
+        """
+        acquire的asyncio版本，等待时不阻塞事件循环。
+        """
+        wait = self._reserve(robot_code, endpoint, conversation)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done()
+        return wait
+
+    def stats(self) -> dict:
+        """
+        return: 当前排队数、累计被延迟的请求数和累计等待秒数
+        """
+        with self._lock:
+            return {
+                "waiting": self.waiting,
+                "delayed": self.delayed,
+                "wait_seconds": self.wait_seconds,
+            }
+
+
+_default_limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    获取进程内共享的限流器，所有发送器和SDK请求默认共用。
+    """
+    return _default_limiter
@@ -0,0 +1,328 @@
+from .utils import requests, time, threading
+from urllib3.exceptions import ConnectTimeoutError
+import asyncio
+import http.client
+import random
+import socket
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class SendError(ValueError):
+    """
+    调用钉钉接口失败，携带HTTP状态码和错误码，供重试策略判断是否可以重试。
+    """
+
+    def __init__(
+        self, message: str, status_code: int = None, errcode=None, retry_after=None
+    ) -> None:
+        """
+        param message: 错误信息
+        param status_code: HTTP状态码
+        param errcode: 钉钉返回的错误码，新版接口为code字符串，旧版接口为errcode整数
+        param retry_after: 服务端要求的等待秒数(Retry-After头)
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.errcode = errcode
+        self.retry_after = retry_after
+
+
+def check_response(response, message: str):
+    """
+    检查钉钉接口的响应，HTTP状态码非200或errcode非0时抛出SendError。
+    param response: requests的响应对象
+    param message: 错误信息前缀
+    """
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    errcode = data.get("code", data.get("errcode"))
+    if response.status_code == 200 and not errcode:
+        return
+    detail = data.get("message") or data.get("errmsg") or response.text[:200]
+    try:
+        retry_after = float(response.headers.get("Retry-After") or 0)
+    except ValueError:
+        # HTTP日期格式的Retry-After不做解析，按退避策略等待
+        retry_after = 0
+    raise SendError(
+        f"{message}: {detail}",
+        status_code=response.status_code,
+        errcode=errcode,
+        retry_after=retry_after,
+    )
+
+
+def is_connect_error(error: Exception) -> bool:
+    """
+    判断异常是否发生在建立连接阶段，即请求还未发出，服务端不可能已经处理。
+    包括连接被拒绝、域名解析失败和连接超时，读超时、连接中途断开等不算。
+    """
+    if isinstance(error, (ConnectionRefusedError, socket.gaierror)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # requests把urllib3的MaxRetryError包装在args[0]中，其reason为真正的原因
+        reason = getattr(error.args[0], "reason", error.args[0])
+        return isinstance(reason, ConnectTimeoutError)
+    if httpx is not None:
+        # 启用http2时的会话抛出httpx的异常，PoolTimeout为等待连接池超时，请求同样未发出
+        return isinstance(
+            error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+        )
+    return False
+
+
+class RetryBudget:
+    """
+    全局重试预算。每次首发请求存入ratio个令牌，每次重试取出1个，令牌不足时放弃重试，
+    因此重试量最多占正常请求量的ratio倍，钉钉整体故障时重试不会把流量放大数倍。
+    另按min_per_second补充令牌，保证请求量很小时也能重试。
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, min_per_second: float = 1, capacity: float = 20
+    ) -> None:
+        """
+        初始化。
+        param ratio: 重试请求数与首发请求数之比的上限
+        param min_per_second: 每秒至少允许的重试次数
+        param capacity: 令牌上限，即故障开始时最多允许的突发重试数
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.last
+        self.last = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.min_per_second)
+
+    def deposit(self):
+        """
+        记录一次首发请求。
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        申请一次重试。
+        return: 预算是否允许
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    重试策略：指数退避加全抖动(full jitter)，只重试连接错误、可重试的HTTP状态码和错误码，
+    受单次请求的总时限和全局重试预算约束。
+    发送消息的接口并非幂等，服务端已处理但响应丢失时重试会导致重复消息，
+    因此非幂等的请求只重试请求发出前的连接错误以及限流和服务不可用，幂等的请求(查询、获取token)才按上述全部条件重试。
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.2,
+        max_delay: float = 5,
+        deadline: float = 30,
+        retry_statuses: tuple = (429, 500, 502, 503, 504),
+        retry_errcodes: tuple = (
+            -1,
+            "ServiceUnavailable",
+            "Forbidden.AccessDenied.QpsLimitForApi",
+            "Forbidden.AccessDenied.QpsLimitForAppkeyAndApi",
+        ),
+        unsafe_retry_statuses: tuple = (429, 503),
+        unsafe_retry_errcodes: tuple = (
+            "ServiceUnavailable",
+            "Forbidden.AccessDenied.QpsLimitForApi",
+            "Forbidden.AccessDenied.QpsLimitForAppkeyAndApi",
+        ),
+        budget: RetryBudget = None,
+    ) -> None:
+        """
+        初始化。
+        param max_attempts: 最多尝试次数(含首次)，为1时不重试
+        param base_delay: 首次重试的退避上限(秒)，之后每次翻倍
+        param max_delay: 单次退避的上限(秒)
+        param deadline: 单次请求从首发到放弃的总时限(秒)，退避后会超出时限则不再重试
+        param retry_statuses: 可重试的HTTP状态码
+        param retry_errcodes: 可重试的钉钉错误码，-1为系统繁忙
+        param unsafe_retry_statuses: 非幂等请求可重试的HTTP状态码，服务端应尚未处理请求
+        param unsafe_retry_errcodes: 非幂等请求可重试的钉钉错误码
+        param budget: 重试预算，默认为每个策略单独创建一个
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_errcodes = frozenset(retry_errcodes)
+        self.unsafe_retry_statuses = frozenset(unsafe_retry_statuses)
+        self.unsafe_retry_errcodes = frozenset(unsafe_retry_errcodes)
+        self.budget = budget or RetryBudget()
+        self.calls = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.budget_exhausted = 0
+        self._lock = threading.Lock()
+
+    def retryable(self, error: Exception, idempotent: bool = True) -> bool:
+        """
+        判断异常是否值得重试。
+        param idempotent: 请求是否幂等，为False时只在确定服务端未处理请求时重试
+        """
+        if idempotent:
+            statuses, errcodes = self.retry_statuses, self.retry_errcodes
+        else:
+            statuses, errcodes = self.unsafe_retry_statuses, self.unsafe_retry_errcodes
+        status = getattr(error, "status_code", None) or getattr(error, "status", None)
+        if status in statuses:
+            return True
+        errcode = getattr(error, "errcode", None)
+        if errcode is not None:
+            return errcode in errcodes
+        if isinstance(status, int):
+            return False
+        if not idempotent:
+            return is_connect_error(error)
+        # 连接被重置、超时等网络错误；requests的异常也是OSError的子类，httpx的异常则不是
+        if httpx is not None and isinstance(error, httpx.TransportError):
+            return True
+        return isinstance(error, (OSError, http.client.HTTPException))
+
+    def backoff(self, attempt: int, error: Exception = None) -> float:
+        """
+        第attempt次重试前的等待秒数，服务端给出Retry-After时以其为下限。
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _next_delay(
+        self, attempt: int, error: Exception, started: float, idempotent: bool
+    ):
+        """
+        决定是否重试。
+        return: 等待秒数，不重试时为None
+        """
+        if attempt >= self.max_attempts or not self.retryable(error, idempotent):
+            return None
+        delay = self.backoff(attempt, error)
+        if time.monotonic() + delay - started > self.deadline:
+            return None
+        if not self.budget.withdraw():
+            with self._lock:
+                self.budget_exhausted += 1
+            return None
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def _start(self) -> float:
+        self.budget.deposit()
+        with self._lock:
+            self.calls += 1
+        return time.monotonic()
+
+    def _give_up(self, attempt: int):
+        if attempt > 1:
+            with self._lock:
+                self.gave_up += 1
+
+    def call(self, func, *args, idempotent: bool = True, **kwargs):
+        """
+        调用func，失败时按策略重试，放弃时抛出最后一次的异常。
+        param idempotent: 请求是否幂等，发送消息等非幂等请求应传入False，见retryable
+        """
+        started = self._start()
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(attempt, e, started, idempotent)
+                if delay is None:
+                    self._give_up(attempt)
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, func, *args, idempotent: bool = True, **kwargs):
+        """
+        call的asyncio版本，func为协程函数，退避时不阻塞事件循环。
+        """
+        started = self._start()
+        attempt = 1
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(attempt, e, started, idempotent)
+                if delay is None:
+                    self._give_up(attempt)
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        """
+        return: 调用次数、重试次数、重试后仍失败的次数、因预算不足放弃的次数
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "budget_exhausted": self.budget_exhausted,
+            }
+
+
+def create_retry_policy(config: dict) -> RetryPolicy:
+    """
+    根据配置创建重试策略。
+    param config: 如{"max_attempts": 4, "deadline": 30, "budget": {"ratio": 0.2}}，budget为RetryBudget的参数
+    """
+    config = dict(config)
+    budget = RetryBudget(**config.pop("budget", {}))
+    return RetryPolicy(budget=budget, **config)
+
+
+_default_policy = RetryPolicy()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """
+    获取进程内共享的重试策略，发送器、token刷新和SDK请求默认共用，从而共用一份重试预算。
+    """
+    return _default_policy
+
+
+def set_retry_policy(policy: RetryPolicy):
+    """
+    替换进程内共享的重试策略。
+    param policy: 重试策略，RetryPolicy(max_attempts=1)可关闭重试
+    """
+    global _default_policy
+    _default_policy = policy
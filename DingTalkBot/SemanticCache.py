@@ -0,0 +1,153 @@
+from .utils import json, threading, time
+from .AnswerCache import normalize_question, turn_hash
+import hashlib
+import re
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 数字、英文标识符和运算符，两个问题的这些部分必须完全相同才能命中
+_LITERALS = re.compile(r"[0-9a-z_.]+|[+\-*/^%=<>()]")
+
+
+class SemanticCache:
+    """
+    语义回答缓存，命中写法不同但意思相近的问题。
+    问题按字符n-gram哈希成定长向量(不依赖外部模型)，所有向量存放在一个预分配的NumPy矩阵中，
+    查询时与全部缓存向量做一次矩阵乘法求余弦相似度，上下文相同且相似度不低于threshold时返回缓存的回答。
+    矩阵按环形缓冲区逐条写入，写满后覆盖最早的记录，内存占用固定为max_entries*dim*4字节。
+    上下文包括公共对话记录和用户自己的对话记录，不同对话中的追问不会互相命中。
+    字符n-gram只反映字面相似：能命中语气词、标点、少量增删字的差别，用词完全不同的同义问法仍会未命中；
+    只差一两个关键字的问题("今天天气"和"明天天气")相似度也很高，threshold不宜过低。
+    只差一个数字的问题("12345+67890"和"12345+67891")相似度可达0.94，因此问题中的数字、英文标识符和运算符
+    须完全相同才能命中，与上下文一起决定可比较的范围。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        max_entries: int = 10000,
+        dim: int = 512,
+        ngrams: tuple = (1, 2, 3),
+        ttl: float = 3600,
+    ) -> None:
+        """
+        初始化。
+        param threshold: 命中所需的最低余弦相似度
+        param max_entries: 缓存的问题数上限
+        param dim: 向量维数，越大哈希冲突越少，查询越慢
+        param ngrams: 使用的字符n-gram长度
+        param ttl: 回答的有效秒数
+        """
+        if np is None:
+            raise ImportError("语义缓存需要安装numpy: pip install numpy")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dim = dim
+        self.ngrams = ngrams
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._contexts = np.zeros(max_entries, dtype=np.int64)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._answers = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def embed(self, msg: str):
+        """
+        把问题哈希成单位向量：每个字符n-gram按crc32落到一个维度上，并由哈希的最高位决定正负，减少冲突带来的偏差。
+        return: 长度为dim的float32向量，问题为空时全为0
+        """
+        text = normalize_question(msg)
+        hashes = [
+            zlib.crc32(text[i : i + n].encode())
+            for n in self.ngrams
+            for i in range(len(text) - n + 1)
+        ]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not hashes:
+            return vector
+        hashes = np.array(hashes, dtype=np.uint32)
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dim, signs)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+    @staticmethod
+    def _context_id(model: str, msg: str, context: list) -> int:
+        """
+        模型、上下文和问题中的数字等字面量的摘要，只有摘要相同的问题之间才比较相似度。
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(model.encode())
+        for turn in context:
+            digest.update(turn_hash(turn).encode())
+        literals = _LITERALS.findall(normalize_question(msg))
+        digest.update(json.dumps(literals).encode())
+        return int.from_bytes(digest.digest(), "little", signed=True)
+
+    def get(self, model: str, msg: str, context: list) -> str:
+        """
+        查找相似问题的缓存回答。
+        param model: 模型名称
+        param msg: 用户输入的问题
+        param context: 上下文，格式为[[用户问题1,机器人回答1],...]
+        return: 缓存的回答，未命中时为None
+        """
+        query = self.embed(msg)
+        context_id = self._context_id(model, msg, context)
+        now = time.time()
+        with self._lock:
+            size = self._size
+            if size:
+                scores = self._vectors[:size] @ query
+                scores[
+                    (self._contexts[:size] != context_id) | (self._expires[:size] <= now)
+                ] = -1
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return self._answers[best]
+            self.misses += 1
+            return None
+
+    def put(self, model: str, msg: str, context: list, answer: str):
+        """
+        缓存一条回答，参数同get。写满时覆盖最早的一条。
+        """
+        vector = self.embed(msg)
+        if not vector.any():
+            return
+        context_id = self._context_id(model, msg, context)
+        with self._lock:
+            row = self._next
+            self._vectors[row] = vector
+            self._contexts[row] = context_id
+            self._expires[row] = time.time() + self.ttl
+            self._answers[row] = answer
+            self._next = (row + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def clear(self):
+        """
+        删除所有缓存。
+        """
+        with self._lock:
+            self._size = 0
+            self._next = 0
+            self._answers = [None] * self.max_entries
+
+    def stats(self) -> dict:
+        """
+        return: 缓存数、命中数、未命中数
+        """
+        with self._lock:
+            return {"entries": self._size, "hits": self.hits, "misses": self.misses}
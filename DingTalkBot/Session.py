@@ -0,0 +1,101 @@
+from .utils import requests, threading
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class DingTalkSession(requests.Session):
+    """
+    访问api.dingtalk.com和oapi.dingtalk.com的共享会话。
+    连接按域名池化并保持长连接，后续请求复用已完成TLS握手的连接；
+    未指定timeout的请求使用默认超时，避免连接挂起时重试策略无从生效。
+    """
+
+    def __init__(
+        self, pool_connections: int = 4, pool_maxsize: int = 32, timeout: float = 10
+    ) -> None:
+        """
+        初始化。
+        param pool_connections: 缓存连接池的域名数
+        param pool_maxsize: 每个域名保留的长连接数，应不小于并发发送的线程数
+        param timeout: 默认超时秒数
+        """
+        super().__init__()
+        self.timeout = timeout
+        # 重试由RetryPolicy统一处理，这里不再重试
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+if httpx is not None:
+
+    class Http2Session(httpx.Client):
+        """
+        启用HTTP/2的会话。与requests一致，request的data参数可以直接传入bytes。
+        """
+
+        def request(self, method, url, *, data=None, **kwargs):
+            if isinstance(data, bytes):
+                kwargs["content"] = data
+                data = None
+            return super().request(method, url, data=data, **kwargs)
+
+
+def create_session(
+    pool_connections: int = 4,
+    pool_maxsize: int = 32,
+    timeout: float = 10,
+    http2: bool = False,
+):
+    """
+    创建共享会话。
+    param pool_connections: 缓存连接池的域名数
+    param pool_maxsize: 每个域名保留的长连接数
+    param timeout: 默认超时秒数
+    param http2: 是否启用HTTP/2，多个请求复用同一条连接，需要安装httpx[http2]
+    return: DingTalkSession，启用HTTP/2时为Http2Session，二者的request/get/post用法一致
+    """
+    if not http2:
+        return DingTalkSession(pool_connections, pool_maxsize, timeout)
+    if httpx is None:
+        raise ImportError("启用http2需要安装httpx[http2]: pip install httpx[http2]")
+    limits = httpx.Limits(
+        max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize
+    )
+    return Http2Session(http2=True, limits=limits, timeout=timeout)
+
+
+_default_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    获取进程内共享的会话，同一进程内的所有发送器和机器人共用一组连接。
+    """
+    global _default_session
+    if _default_session is None:
+        with _session_lock:
+            if _default_session is None:
+                _default_session = create_session()
+    return _default_session
+
+
+def set_session(session):
+    """
+    替换进程内共享的会话。
+    param session: create_session创建的会话，或任何提供request/get方法的兼容对象
+    """
+    global _default_session
+    with _session_lock:
+        _default_session = session
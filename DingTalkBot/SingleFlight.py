@@ -0,0 +1,104 @@
+from .utils import threading
+from .AnswerCache import answer_key
+from concurrent.futures import Future
+
+
+class Abandoned(Exception):
+    """
+    首个请求的调用方中途放弃(如流式输出被关闭)，没有得到完整回答。
+    """
+
+
+class SingleFlight:
+    """
+    合并相同的大模型请求。
+    模型、上下文和问题都相同的请求正在进行时，后到的请求不再调用大模型，而是等待同一个结果；
+    每个调用方仍各自回复自己的消息。请求结束后即移除，之后的相同问题交给回答缓存处理。
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.saved = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, model: str, msg: str, context: list) -> tuple:
+        """
+        加入一次请求。
+        return: (键, Future, 是否为首个请求)，首个请求负责调用大模型并用finish通知其他请求
+        """
+        key, _ = answer_key(model, msg, context)
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.saved += 1
+                return key, future, False
+            future = self._flights[key] = Future()
+            self.calls += 1
+            return key, future, True
+
+    def finish(self, key: str, future: Future, result=None, error: BaseException = None):
+        """
+        首个请求结束，唤醒等待的请求。
+        param error: 请求失败时的异常
+        """
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if error is None:
+            future.set_result(result)
+        else:
+            if not isinstance(error, Exception):
+                error = Abandoned(repr(error))
+            future.set_exception(error)
+
+    def do(self, model: str, msg: str, context: list, func):
+        """
+        同步执行一次请求，相同的请求进行中时等待其结果。
+        param func: 调用大模型的无参函数
+        return: func的返回值
+        """
+        key, future, leader = self.join(model, msg, context)
+        if not leader:
+            try:
+                return future.result()
+            except Abandoned:
+                # 首个请求中途放弃，自己调用
+                return func()
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def stats(self) -> dict:
+        """
+        return: 实际调用大模型的次数、合并掉(节省)的调用次数、进行中的请求数
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "saved": self.saved,
+                "inflight": len(self._flights),
+            }
+
+
+_default_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    获取进程内共享的请求合并器，为None时不合并。
+    """
+    return _default_flight
+
+
+def set_single_flight(flight: SingleFlight):
+    """
+    替换进程内共享的请求合并器。
+    param flight: SingleFlight，为None时关闭请求合并
+    """
+    global _default_flight
+    _default_flight = flight
@@ -0,0 +1,136 @@
+from .utils import threading, time
+from .Context import make_turn
+from .func import context_reader, compact_context
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_QUESTION = "请回顾我们之前的对话"
+SUMMARY_PROMPT = (
+    "请把下面的多轮对话总结成一段简洁的要点，保留用户的身份、偏好、提到的事实和尚未解决的问题，"
+    "不要编造，不超过{limit}字。\n\n{dialog}"
+)
+
+
+class ContextSummarizer:
+    """
+    对话摘要。
+    用户的对话记录距离上限不足keep轮时，在后台线程中用低成本模型(如sparkLite)把最旧的若干轮总结成一轮摘要，
+    替换存储中的这些轮次；此时旧对话尚未被挤出窗口，摘要完成前的几条新消息也不会导致丢失。
+    摘要不在消息处理路径上，不增加回复延迟；之后的请求上下文更短，同时保留了早期对话的要点。
+    """
+
+    def __init__(
+        self,
+        summarize,
+        turns: int = 10,
+        keep: int = 4,
+        limit: int = 300,
+        cooldown: float = 300,
+        max_workers: int = 1,
+        max_users: int = 10000,
+    ) -> None:
+        """
+        初始化。
+        param summarize: 调用大模型的函数，形如summarize(msg, context)，应直接调用模型而不经过回答缓存，
+            如functools.partial(SparkAI(...)._generate, *SPARK_MODELS["sparkLite"])
+        param turns: 每次最多总结的轮数
+        param keep: 保留原文的最新轮数，也是触发摘要时距离上限的轮数
+        param limit: 摘要的字数上限
+        param cooldown: 同一用户两次摘要之间的最短间隔(秒)，避免摘要无效时每条消息都触发
+        param max_workers: 并发摘要的线程数
+        param max_users: 记录摘要时间的用户数上限
+        """
+        self.summarize = summarize
+        self.turns = turns
+        self.keep = keep
+        self.limit = limit
+        self.cooldown = cooldown
+        self.max_users = max_users
+        self.requested = 0
+        self.compacted = 0
+        self.skipped = 0
+        self.failed = 0
+        self.tokens_saved = 0
+        self._pending = set()
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ContextSummarizer"
+        )
+
+    def request(self, user_id: str) -> bool:
+        """
+        请求在后台总结用户最旧的对话，立即返回。
+        return: 是否已提交，用户已有摘要在进行或仍在冷却中时为False
+        """
+        now = time.monotonic()
+        with self._lock:
+            if user_id in self._pending:
+                return False
+            last = self._last.get(user_id)
+            if last is not None and now - last < self.cooldown:
+                return False
+            self._pending.add(user_id)
+            self._last[user_id] = now
+            self._last.move_to_end(user_id)
+            while len(self._last) > self.max_users:
+                self._last.popitem(last=False)
+            self.requested += 1
+        self._executor.submit(self._run, user_id)
+        return True
+
+    def _run(self, user_id: str):
+        try:
+            result = self.compact(user_id)
+        except Exception as e:
+            print(f"对话摘要失败: {e}")
+            result = None
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
+        with self._lock:
+            if result is None:
+                self.failed += 1
+            elif result:
+                self.compacted += 1
+                self.tokens_saved += result
+            else:
+                self.skipped += 1
+
+    def compact(self, user_id: str) -> int:
+        """
+        总结用户最旧的对话并替换，在调用线程中执行。
+        return: 节省的token数，对话太少、摘要没有更短或期间对话记录已被清空时为0
+        """
+        turns, _ = context_reader(user_id)
+        old = turns[: min(self.turns, len(turns) - self.keep)]
+        if len(old) < 2:
+            return 0
+        dialog = "\n".join(f"用户: {turn[0]}\n助手: {turn[1]}" for turn in old)
+        summary = self.summarize(
+            SUMMARY_PROMPT.format(limit=self.limit, dialog=dialog), []
+        ).strip()
+        turn = make_turn(SUMMARY_QUESTION, summary)
+        saved = sum(t[2] for t in old) - turn[2]
+        if not summary or saved <= 0:
+            return 0
+        if not compact_context(user_id, old, turn):
+            return 0
+        return saved
+
+    def stats(self) -> dict:
+        """
+        return: 请求数、完成数、跳过数、失败数、累计节省的token数、进行中的数量
+        """
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "compacted": self.compacted,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "tokens_saved": self.tokens_saved,
+                "pending": len(self._pending),
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,135 @@
+from .utils import json
+from json.encoder import encode_basestring
+
+# 预先创建的编码器，json.dumps带参数时每次调用都会新建编码器
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _encode(value) -> str:
+    if type(value) is str:
+        return encode_basestring(value)
+    return _encoder.encode(value)
+
+
+class MsgTemplate:
+    """
+    某个msgKey的消息参数模板。
+    字段名、括号和分隔符在创建时编码好，渲染时只编码各字段的值，得到合法的JSON文本。
+    """
+
+    def __init__(self, msg_key: str, fields: tuple) -> None:
+        """
+        初始化。
+        param msg_key: 消息类型，如sampleText
+        param fields: msgParam的字段名，按输出顺序排列
+        """
+        self.msg_key = msg_key
+        self.fields = tuple(fields)
+        self._field_set = frozenset(self.fields)
+        self._prefixes = tuple(
+            ("{" if i == 0 else ",") + encode_basestring(field) + ":"
+            for i, field in enumerate(self.fields)
+        )
+
+    def matches(self, msgParam: dict) -> bool:
+        """
+        msgParam的字段是否与模板完全一致。
+        """
+        return msgParam.keys() == self._field_set
+
+    def render(self, msgParam: dict) -> str:
+        """
+        渲染msgParam。
+        return: msgParam的JSON文本
+        """
+        parts = []
+        for prefix, field in zip(self._prefixes, self.fields):
+            parts.append(prefix)
+            parts.append(_encode(msgParam[field]))
+        parts.append("}")
+        return "".join(parts)
+
+
+TEMPLATES = {}
+
+
+def register_template(msg_key: str, fields: tuple) -> MsgTemplate:
+    """
+    注册消息模板，用于扩展新的消息类型。
+    param msg_key: 消息类型
+    param fields: msgParam的字段名
+    """
+    template = TEMPLATES[msg_key] = MsgTemplate(msg_key, fields)
+    return template
+
+
+def _action_fields(count: int) -> tuple:
+    fields = ("title", "text")
+    for i in range(1, count + 1):
+        fields += (f"actionTitle{i}", f"actionURL{i}")
+    return fields
+
+
+register_template("sampleText", ("content",))
+register_template("sampleMarkdown", ("title", "text"))
+register_template("sampleImage", ("photoURL",))
+register_template("sampleLink", ("title", "text", "picUrl", "messageUrl"))
+register_template("sampleActionCard", ("title", "text", "singleTitle", "singleURL"))
+for _count in range(2, 6):
+    register_template(f"sampleActionCard{_count}", _action_fields(_count))
+register_template(
+    "sampleActionCard6",
+    ("title", "text", "buttonTitle1", "buttonUrl1", "buttonTitle2", "buttonUrl2"),
+)
+register_template("sampleAudio", ("mediaId", "duration"))
+register_template("sampleFile", ("mediaId", "fileName", "fileType"))
+register_template(
+    "sampleVideo",
+    ("videoMediaId", "duration", "videoType", "picMediaId", "height", "width"),
+)
+
+
+def encode_param(msg_key: str, msgParam: dict) -> str:
+    """
+    把msgParam编码为JSON文本，已注册且字段一致的消息类型走模板，其余直接编码。
+    """
+    template = TEMPLATES.get(msg_key)
+    if template is not None and template.matches(msgParam):
+        return template.render(msgParam)
+    return _encoder.encode(msgParam)
+
+
+_heads = {}
+
+
+def encode_body(msg_key: str, msgParam: dict, robot_code: str) -> bytes:
+    """
+    编码请求体中除接收者以外的部分。同一条消息发往多个批次时只需编码一次。
+    param msg_key: 消息类型
+    param msgParam: 消息参数
+    param robot_code: 机器人编码
+    return: 未闭合的请求体，交给finish_body补上接收者
+    """
+    head = _heads.get((msg_key, robot_code))
+    if head is None:
+        head = _heads[(msg_key, robot_code)] = (
+            '{"msgKey":'
+            + encode_basestring(msg_key)
+            + ',"robotCode":'
+            + encode_basestring(robot_code)
+            + ',"msgParam":'
+        ).encode()
+    # 接口要求msgParam是JSON字符串，因此再编码一次
+    return head + encode_basestring(encode_param(msg_key, msgParam)).encode()
+
+
+def finish_body(partial: bytes, field: str, value) -> bytes:
+    """
+    补上接收者字段，得到完整的请求体。
+    param partial: encode_body的结果
+    param field: 接收者字段名，userIds或openConversationId
+    param value: 接收者
+    """
+    return b"".join(
+        (partial, b',"', field.encode(), b'":', _encode(value).encode(), b"}")
+    )
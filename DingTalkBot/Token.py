@@ -0,0 +1,163 @@
+from .utils import time, threading, json
+from concurrent.futures import Future
+from .Retry import RetryPolicy, get_retry_policy, check_response
+from .Session import get_session
+
+
+class TokenManager:
+    """
+    access_token管理器。
+    缓存token及其有效期，在过期前于后台刷新，并发调用者共享同一次刷新请求(single-flight)。
+    [官方文档](https://open.dingtalk.com/document/orgapp/obtain-orgapp-token)
+    """
+
+    api = "https://oapi.dingtalk.com/gettoken"
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        refresh_ahead: int = 300,
+        background: bool = True,
+        retry_policy: RetryPolicy = None,
+        session=None,
+    ) -> None:
+        """
+        初始化。
+        param client_id: 客户端ID。
+        param client_secret: 客户端密钥。
+        param refresh_ahead: 提前多少秒刷新token，默认300秒。
+        param background: 是否在过期前由后台线程自动刷新，默认开启。
+        param retry_policy: 重试策略，默认使用进程内共享的实例。
+        param session: HTTP会话，默认使用进程内共享的连接池。
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        if not self.client_id or not self.client_secret:
+            raise ValueError("client_id或client_secret未配置")
+        self.refresh_ahead = refresh_ahead
+        self.background = background
+        self.retry_policy = retry_policy
+        self.session = session
+        self.fetch_count = 0
+        self._token = None
+        self._expire_at = 0.0
+        self._lock = threading.Lock()
+        self._flight = None
+        self._timer = None
+
+    def _fetch(self) -> tuple:
+        """
+        向钉钉请求新的token，失败时按重试策略重试。
+        return: (access_token, 有效期秒数)
+        """
+        policy = self.retry_policy or get_retry_policy()
+        data = policy.call(self._fetch_once)
+        return data["access_token"], int(data.get("expires_in", 7200))
+
+    def _fetch_once(self) -> dict:
+        session = self.session or get_session()
+        response = session.get(
+            self.api, params={"appkey": self.client_id, "appsecret": self.client_secret}
+        )
+        check_response(response, "获取token失败")
+        return response.json()
+
+    def _is_fresh(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expire_at
+
+    def get_token(self) -> str:
+        """
+        获取token，缓存有效时直接返回，否则同步刷新。
+        """
+        token = self._token
+        if token is not None and time.monotonic() < self._expire_at:
+            return token
+        return self.refresh()
+
+    def refresh(self, force: bool = False) -> str:
+        """
+        刷新token。同一时刻只会有一个请求发往钉钉，其余调用者等待其结果。
+        param force: 为False时，若等待期间token已被其他线程刷新则直接返回缓存。
+        """
+        with self._lock:
+            if not force and self._is_fresh():
+                return self._token
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = Future()
+        if not leader:
+            return flight.result()
+        try:
+            token, expires_in = self._fetch()
+            with self._lock:
+                self.fetch_count += 1
+                self._token = token
+                # 留出余量，避免拿到即将过期的token
+                self._expire_at = time.monotonic() + max(expires_in - 60, 0)
+            self._schedule(expires_in)
+            flight.set_result(token)
+            return token
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._flight = None
+
+    def _schedule(self, expires_in: int):
+        """
+        安排后台线程在过期前刷新token。
+        """
+        if not self.background:
+            return
+        delay = expires_in - self.refresh_ahead
+        if delay <= 0:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh(force=True)
+        except Exception as e:
+            # 后台刷新失败不影响调用方，下次get_token时会同步重试
+            print(f"后台刷新token失败: {e}")
+
+    def close(self):
+        """
+        停止后台刷新。
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(client_id: str, client_secret: str) -> TokenManager:
+    """
+    获取同一应用共享的TokenManager，同一进程内的发送器、上传器共用一份token缓存。
+    param client_id: 客户端ID。
+    param client_secret: 客户端密钥。
+    """
+    key = (client_id, client_secret)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = TokenManager(client_id, client_secret)
+        return manager
+
+
+if __name__ == "__main__":
+
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    manager = get_token_manager(config["client_id"], config["client_secret"])
+    print(manager.get_token())
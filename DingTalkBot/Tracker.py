@@ -0,0 +1,355 @@
+from .utils import time, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import heapq
+import itertools
+import uuid
+
+
+class _Entry:
+    """
+    一个待查询的processQueryKey。
+    """
+
+    __slots__ = (
+        "key",
+        "broadcast_id",
+        "recipients",
+        "conversation",
+        "created",
+        "interval",
+        "due",
+        "delivered",
+        "read",
+    )
+
+    def __init__(self, key, broadcast_id, recipients, conversation, now, interval):
+        self.key = key
+        self.broadcast_id = broadcast_id
+        self.recipients = recipients
+        self.conversation = conversation
+        self.created = now
+        self.interval = interval
+        self.due = now + interval
+        self.delivered = False
+        self.read = 0
+
+
+class DeliveryTracker:
+    """
+    消息送达与已读状态跟踪器。
+    收集发送返回的processQueryKey，按批轮询已读状态接口并汇总到所属的群发任务。
+    轮询间隔自适应：状态有变化时回到min_interval，无变化时逐次翻倍直到max_interval；
+    全部已读、被撤回或超过ttl的key不再轮询，内存占用由max_keys和max_broadcasts限定。
+    """
+
+    def __init__(
+        self,
+        patch_sender=None,
+        group_sender=None,
+        min_interval: float = 5,
+        max_interval: float = 300,
+        ttl: float = 3600,
+        batch_size: int = 20,
+        max_workers: int = 4,
+        max_keys: int = 10000,
+        max_broadcasts: int = 1000,
+    ) -> None:
+        """
+        初始化。
+        param patch_sender: PatchSender，用于查询单聊消息
+        param group_sender: GroupSender，用于查询群消息
+        param min_interval: 最短轮询间隔(秒)
+        param max_interval: 最长轮询间隔(秒)
+        param ttl: key和群发任务的最长跟踪时间(秒)
+        param batch_size: 每轮最多查询的key数
+        param max_workers: 并发查询数
+        param max_keys: 同时跟踪的key数上限，超出时丢弃最早的
+        param max_broadcasts: 保留统计结果的群发任务数上限
+        """
+        self.patch_sender = patch_sender
+        self.group_sender = group_sender
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.max_keys = max_keys
+        self.max_broadcasts = max_broadcasts
+        self.polls = 0
+        self._entries = OrderedDict()
+        self._heap = []
+        self._seq = itertools.count()
+        self._broadcasts = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="DeliveryTracker"
+        )
+        self._thread = None
+        self._closed = False
+
+    def _broadcast(self, broadcast_id: str, now: float) -> dict:
+        record = self._broadcasts.get(broadcast_id)
+        if record is None:
+            record = self._broadcasts[broadcast_id] = {
+                "created": now,
+                "keys": 0,
+                "pending": 0,
+                "recipients": 0,
+                "failed": 0,
+                "delivered": 0,
+                "read": 0,
+            }
+            while len(self._broadcasts) > self.max_broadcasts:
+                self._broadcasts.popitem(last=False)
+        return record
+
+    def track(
+        self,
+        processQueryKey,
+        broadcast_id: str = None,
+        recipients: int = 1,
+        openConversationId: str = None,
+    ) -> str:
+        """
+        跟踪一次发送。
+        param processQueryKey: 发送返回的加密ID，也可以是dispatcher返回的Future
+        param broadcast_id: 所属群发任务，默认新建一个
+        param recipients: 本次发送的接收人数，群消息为1
+        param openConversationId: 群消息的群ID，单聊为空
+        return: broadcast_id
+        """
+        broadcast_id = broadcast_id or uuid.uuid4().hex
+        if isinstance(processQueryKey, Future):
+            with self._lock:
+                record = self._broadcast(broadcast_id, time.monotonic())
+                record["pending"] += 1
+
+            def resolved(future):
+                with self._lock:
+                    record["pending"] -= 1
+                if future.exception() is not None:
+                    self._fail(broadcast_id, recipients)
+                else:
+                    self.track(
+                        future.result(), broadcast_id, recipients, openConversationId
+                    )
+
+            processQueryKey.add_done_callback(resolved)
+            return broadcast_id
+        with self._lock:
+            now = time.monotonic()
+            record = self._broadcast(broadcast_id, now)
+            record["keys"] += 1
+            record["pending"] += 1
+            record["recipients"] += recipients
+            entry = _Entry(
+                processQueryKey,
+                broadcast_id,
+                recipients,
+                openConversationId,
+                now,
+                self.min_interval,
+            )
+            previous = self._entries.pop(processQueryKey, None)
+            if previous is not None:
+                # 重复跟踪同一个key时以最新的为准，旧记录先停止跟踪
+                self._retire(previous)
+            self._entries[processQueryKey] = entry
+            heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+            while len(self._entries) > self.max_keys:
+                _, oldest = self._entries.popitem(last=False)
+                self._retire(oldest)
+        self._wakeup.set()
+        return broadcast_id
+
+    def _fail(self, broadcast_id: str, recipients: int):
+        with self._lock:
+            record = self._broadcast(broadcast_id, time.monotonic())
+            record["recipients"] += recipients
+            record["failed"] += recipients
+
+    def track_broadcast(
+        self, results: dict, broadcast_id: str = None, group: bool = False
+    ) -> str:
+        """
+        跟踪一次群发的全部批次。
+        param results: PatchSender.broadcast或GroupSender.broadcast的返回值
+        param broadcast_id: 群发任务ID，默认新建一个
+        param group: results是否来自GroupSender.broadcast
+        return: broadcast_id
+        """
+        broadcast_id = broadcast_id or uuid.uuid4().hex
+        with self._lock:
+            self._broadcast(broadcast_id, time.monotonic())
+        if group:
+            for conversation_id, key in results.items():
+                if isinstance(key, Exception):
+                    self._fail(broadcast_id, 1)
+                else:
+                    self.track(key, broadcast_id, 1, conversation_id)
+            return broadcast_id
+        recipients = {}
+        failed = 0
+        for key in results.values():
+            if isinstance(key, Exception):
+                failed += 1
+            else:
+                recipients[key] = recipients.get(key, 0) + 1
+        if failed:
+            self._fail(broadcast_id, failed)
+        for key, count in recipients.items():
+            self.track(key, broadcast_id, count)
+        return broadcast_id
+
+    def _retire(self, entry: _Entry):
+        """
+        停止跟踪一个key，须持有锁。
+        """
+        record = self._broadcasts.get(entry.broadcast_id)
+        if record is not None:
+            record["pending"] -= 1
+
+    def _query(self, entry: _Entry) -> tuple:
+        """
+        查询一个key。
+        return: (是否已送达, 已读人数, 是否无需再查询)
+        """
+        if entry.conversation is None:
+            data = self.patch_sender.query_read_status(entry.key)
+            read = sum(
+                1
+                for info in data.get("messageReadInfoList") or []
+                if info.get("readStatus") == "READ"
+            )
+        else:
+            data = self.group_sender.query_read_status(entry.conversation, entry.key)
+            read = len(data.get("readUserIds") or [])
+        status = data.get("sendStatus")
+        delivered = status == "SUCCESS" or read > 0
+        finished = status == "RECALLED" or (
+            entry.conversation is None and read >= entry.recipients
+        )
+        return delivered, read, finished
+
+    def _update(self, entry: _Entry, result, now: float):
+        with self._lock:
+            if self._entries.get(entry.key) is not entry:
+                return
+            changed = False
+            finished = False
+            if not isinstance(result, Exception):
+                delivered, read, finished = result
+                record = self._broadcasts.get(entry.broadcast_id)
+                if record is not None:
+                    if delivered and not entry.delivered:
+                        record["delivered"] += entry.recipients
+                    record["read"] += read - entry.read
+                changed = delivered != entry.delivered or read != entry.read
+                entry.delivered = entry.delivered or delivered
+                entry.read = read
+            if finished or now - entry.created >= self.ttl:
+                del self._entries[entry.key]
+                self._retire(entry)
+                return
+            if changed:
+                entry.interval = self.min_interval
+            else:
+                entry.interval = min(entry.interval * 2, self.max_interval)
+            entry.due = now + entry.interval
+            heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+
+    def _due(self, now: float) -> list:
+        """
+        取出已到查询时间的key，最多batch_size个，须持有锁。
+        """
+        batch = []
+        while self._heap and len(batch) < self.batch_size:
+            due, _, entry = self._heap[0]
+            if self._entries.get(entry.key) is not entry or entry.due != due:
+                # 已停止跟踪或已重新排期
+                heapq.heappop(self._heap)
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            batch.append(entry)
+        return batch
+
+    def poll(self) -> int:
+        """
+        查询一批到期的key并更新统计。
+        return: 本轮查询的key数
+        """
+        with self._lock:
+            batch = self._due(time.monotonic())
+        futures = [(entry, self._executor.submit(self._query, entry)) for entry in batch]
+        for entry, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            self._update(entry, result, time.monotonic())
+        with self._lock:
+            self.polls += len(batch)
+        return len(batch)
+
+    def _next_due(self) -> float:
+        with self._lock:
+            while self._heap:
+                due, _, entry = self._heap[0]
+                if self._entries.get(entry.key) is entry and entry.due == due:
+                    return due
+                heapq.heappop(self._heap)
+        return None
+
+    def _run(self):
+        while not self._closed:
+            if self.poll():
+                continue
+            due = self._next_due()
+            timeout = None if due is None else max(due - time.monotonic(), 0)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        启动后台轮询线程。
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="DeliveryTracker", daemon=True
+            )
+            self._thread.start()
+
+    def close(self):
+        """
+        停止后台轮询。
+        """
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self, broadcast_id: str) -> dict:
+        """
+        群发任务的汇总结果。群消息的recipients和delivered按群计数，read为已读人数。
+        return: {"keys", "pending", "recipients", "failed", "delivered", "read"}，任务不存在或已过期时为None
+        """
+        with self._lock:
+            record = self._broadcasts.get(broadcast_id)
+            if record is None:
+                return None
+            if time.monotonic() - record["created"] >= self.ttl and not record["pending"]:
+                del self._broadcasts[broadcast_id]
+                return None
+            return {k: v for k, v in record.items() if k != "created"}
+
+    def tracked(self) -> int:
+        """
+        当前仍在跟踪的key数。
+        """
+        with self._lock:
+            return len(self._entries)
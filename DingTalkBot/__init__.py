@@ -1,7 +1,21 @@
 from .AiModle import *
+from .AnswerCache import *
 from .BotServer import *
+from .Context import *
+from .Dedup import *
+from .Dispatcher import *
 from .func import *
 from .Media import *
 from .MsgSender import *
 from .MsgSender import *
+from .Outbox import *
+from .RateLimiter import *
+from .Retry import *
+from .SemanticCache import *
+from .Session import *
+from .SingleFlight import *
+from .Summarizer import *
+from .Template import *
+from .Token import *
+from .Tracker import *
 from .utils import *
\ No newline at end of file
@@ -1,4 +1,17 @@
-from .utils import json, os, re
+from .Context import ContextStore
+from .AnswerCache import get_answer_cache
+
+_store = ContextStore()
+
+
+def set_context_store(store: ContextStore):
+    """
+    替换对话记录的存储后端，例如LogContextStore
+    param store: 存储后端对象
+    """
+    global _store
+    _store.flush()
+    _store = store
 
 
 def context_recorder(user_id: str, user_msg: str, bot_msg: str):
@@ -9,20 +22,7 @@ def context_recorder(user_id: str, user_msg: str, bot_msg: str):
     param user_msg: 用户输入的消息
     param bot_msg: 机器人回复的消息
     """
-    folder_path = "contexts"
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    file_path = f"contexts/{user_id}.json"
-    try:
-        with open(file_path, "r") as f:
-            record = json.load(f)
-    except:
-        record = []
-    record.append([user_msg, bot_msg])
-    if len(record) > 20:
-        record.pop(0)
-    with open(file_path, "w") as f:
-        json.dump(record, f)
+    _store.record(user_id, user_msg, bot_msg)
 
 
 def context_reader(user_id: str) -> tuple:
@@ -31,19 +31,34 @@ def context_reader(user_id: str) -> tuple:
     param user_id: 用户ID
     return: 对话记录列表,对话记录是否已满
     """
-    folder_path = "contexts"
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    file_path = f"contexts/{user_id}.json"
-    try:
-        with open(file_path, "r") as f:
-            record = json.load(f)
-    except:
-        record = []
-    full = False
-    if len(record) >= 20:
-        full = True
-    return record, full
+    return _store.read(user_id)
+
+
+def context_window(user_id: str, budget: int, margin: int = 0) -> tuple:
+    """
+    读取公共对话记录和用户的对话记录，组装成token数不超过预算的上下文
+    param user_id: 用户ID
+    param budget: token预算，见AiModle.context_budget
+    param margin: 对话记录距离上限不足margin轮时即视为已满，用于在舍弃旧对话之前提前摘要
+    return: 上下文列表,是否有对话被舍弃(或即将被舍弃)
+    """
+    return _store.window(user_id, budget, margin)
+
+
+def compact_context(user_id: str, old: list, turn: list) -> bool:
+    """
+    用一轮对话(如摘要)替换用户最旧的若干轮对话
+    param user_id: 用户ID
+    param old: 被替换的对话，context_reader读到的开头若干轮
+    param turn: 替换后的一轮对话，见Context.make_turn
+    return: 是否已替换
+    """
+    if not _store.compact(user_id, old, turn):
+        return False
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.invalidate(old)
+    return True
 
 
 def add_public_context(context: list):
@@ -51,20 +66,11 @@ def add_public_context(context: list):
     添加公共对话记录,可以用于预设机器人
     param context: 对话记录列表,每个元素为一个列表[user_msg,bot_msg],最多50个元素
     """
-    folder_path = "contexts"
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    file_path = f"contexts/public.json"
-    try:
-        with open(file_path, "r") as f:
-            record = json.load(f)
-    except:
-        record = []
-    record.append(context)
-    if len(record) > 50:
-        record = record[-50:]
-    with open(file_path, "w") as f:
-        json.dump(record, f)
+    _store.add_public(context)
+    # 公共对话记录是所有问答的上下文，变化后缓存的回答全部失效
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.clear()
 
 
 def read_public_context() -> list:
@@ -72,40 +78,26 @@ def read_public_context() -> list:
     读取公共对话记录
     return: 对话记录列表
     """
-    folder_path = "contexts"
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    file_path = f"contexts/public.json"
-    try:
-        with open(file_path, "r") as f:
-            record = json.load(f)
-    except:
-        record = []
-    return record
+    return _store.read_public()
+
 
 def delete_public_context():
     """
     删除公共对话记录
     """
-    folder_path = "contexts"
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    file_path = f"contexts/public.json"
-    try:
-        os.remove(file_path)
-    except:
-        pass
+    _store.delete_public()
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.clear()
+
 
 def context_deleter(user_id: str):
     """
     删除用户和机器人的对话记录
     param user_id: 用户ID
     """
-    folder_path = "contexts"
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
-    file_path = f"contexts/{user_id}.json"
-    try:
-        os.remove(file_path)
-    except:
-        pass
+    cache = get_answer_cache()
+    if cache is not None:
+        turns, _ = _store.read(user_id)
+        cache.invalidate(turns)
+    _store.delete(user_id)
@@ -0,0 +1,75 @@
+"""
+本地桩服务器上对比同步getResponse与getResponseAsync的并发耗时。
+每个请求在服务端延迟RTT秒，N个并发的异步请求应在约一个RTT内完成。
+
+用法: python benchmarks/async_concurrency.py
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dingtalk.api import OapiUserGetRequest
+
+N = 50
+RTT = 0.1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(RTT)
+        body = json.dumps({"errcode": 0, "errmsg": "ok", "userid": "stub"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认backlog为5，并发连接过多时会被丢弃重传
+    request_queue_size = 128
+
+
+def make_request(port):
+    req = OapiUserGetRequest(f"http://127.0.0.1:{port}/user/get")
+    req.userid = "stub"
+    return req
+
+
+async def run_async(port):
+    return await asyncio.gather(
+        *(make_request(port).getResponseAsync("token") for _ in range(N))
+    )
+
+
+if __name__ == "__main__":
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    start = time.perf_counter()
+    for _ in range(N):
+        make_request(port).getResponse("token")
+    sync_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = asyncio.run(run_async(port))
+    async_elapsed = time.perf_counter() - start
+    assert all(r["userid"] == "stub" for r in results)
+
+    print(f"{N} requests, RTT={RTT * 1000:.0f}ms")
+    print(f"sync getResponse       : {sync_elapsed:.3f}s ({sync_elapsed / RTT:.1f} RTT)")
+    print(f"async getResponseAsync : {async_elapsed:.3f}s ({async_elapsed / RTT:.1f} RTT)")
+    server.shutdown()
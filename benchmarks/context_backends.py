@@ -0,0 +1,71 @@
+"""
+对比对话记录存储后端的写入吞吐(turns/sec)。
+baseline为旧实现：每轮读取整个json文件再整体json.dump。
+
+用法: python benchmarks/context_backends.py [用户数] [每用户轮数]
+"""
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.Context import ContextStore, LogContextStore, SqliteContextStore
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+TURNS = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+QUESTION = "请假流程是什么？" * 4
+ANSWER = "请在OA系统中提交请假申请，由直属主管审批。" * 8
+
+
+class BaselineStore:
+    """
+    旧版func.context_recorder的实现。
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+
+    def record(self, user_id, user_msg, bot_msg):
+        if not os.path.exists(self.folder_path):
+            os.makedirs(self.folder_path)
+        file_path = f"{self.folder_path}/{user_id}.json"
+        try:
+            with open(file_path, "r") as f:
+                record = json.load(f)
+        except:
+            record = []
+        record.append([user_msg, bot_msg])
+        if len(record) > 20:
+            record.pop(0)
+        with open(file_path, "w") as f:
+            json.dump(record, f)
+
+    def flush(self):
+        pass
+
+
+def run(name, factory):
+    folder = tempfile.mkdtemp()
+    store = factory(os.path.join(folder, "contexts"))
+    users = [f"user{i}" for i in range(USERS)] * TURNS
+    random.Random(0).shuffle(users)
+    start = time.perf_counter()
+    for user_id in users:
+        store.record(user_id, QUESTION, ANSWER)
+    store.flush()
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(folder)
+    print(f"{name:<22} {len(users) / elapsed:10.0f} turns/sec  ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    print(f"{USERS} users x {TURNS} turns")
+    run("json.dump (baseline)", BaselineStore)
+    run("ContextStore", lambda path: ContextStore(path, flush_delay=3600))
+    run("LogContextStore", LogContextStore)
+    run("SqliteContextStore", SqliteContextStore)
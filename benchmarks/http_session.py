@@ -0,0 +1,105 @@
+"""
+本地HTTPS桩服务器上对比每次发送调用requests.post(旧实现)与共享DingTalkSession的单次发送延迟。
+需要openssl命令生成临时自签名证书。
+
+用法: python benchmarks/http_session.py
+"""
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.Session import DingTalkSession
+
+SENDS = 300
+THREADS = 8
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = 64 * 1024
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"processQueryKey": "stub"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_cert(folder: str) -> tuple:
+    cert = os.path.join(folder, "cert.pem")
+    key = os.path.join(folder, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def measure(send, threads: int) -> list:
+    def timed(_):
+        start = time.perf_counter()
+        response = send()
+        assert response.json()["processQueryKey"] == "stub"
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(threads) as pool:
+        return sorted(pool.map(timed, range(SENDS)))
+
+
+def report(name: str, latencies: list):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    mean = sum(latencies) / len(latencies) * 1000
+    print(f"{name:<28} mean {mean:7.2f}ms  p50 {p50:7.2f}ms  p99 {p99:7.2f}ms")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        cert, key = make_cert(folder)
+        server = StubServer(("127.0.0.1", 0), StubHandler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"https://127.0.0.1:{server.server_address[1]}/v1.0/robot/oToMessages/batchSend"
+        body = {"msgKey": "sampleText", "msgParam": '{"content": "hi"}'}
+
+        session = DingTalkSession(pool_maxsize=THREADS)
+        print(f"{SENDS} sends over local HTTPS")
+        for threads in (1, THREADS):
+            report(
+                f"requests.post, {threads} thread(s)",
+                measure(lambda: requests.post(url, json=body, verify=cert), threads),
+            )
+            report(
+                f"DingTalkSession, {threads} thread(s)",
+                measure(lambda: session.post(url, json=body, verify=cert), threads),
+            )
+        server.shutdown()
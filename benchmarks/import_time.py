@@ -0,0 +1,79 @@
+"""
+测量import dingtalk的耗时与内存，对比按需加载和全部加载。
+子进程以python -X importtime运行，并列出耗时最多的模块。
+测量前先检查按需加载与全部加载时的属性一致：无论以何种方式导入，dingtalk.api.rest.Xxx都是类而不是模块。
+
+用法: python benchmarks/import_time.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 5
+TOP = 5
+
+CASES = (
+    ("lazy", "import dingtalk.api"),
+    ("lazy + 1 class", "from dingtalk.api import OapiMediaUploadRequest"),
+    ("eager", "from dingtalk.api.rest import *"),
+)
+
+# 每段代码在新的子进程中运行，导入方式不同但rest.OapiUserGetRequest都应是类
+CHECKS = (
+    "import dingtalk.api.rest.OapiUserGetRequest",
+    "from dingtalk.api.rest.OapiUserGetRequest import OapiUserGetRequest",
+    "import dingtalk.api.rest; dingtalk.api.rest.OapiUserGetRequest; "
+    "import dingtalk.api.rest.OapiUserGetRequest",
+    "from dingtalk.api import OapiUserGetRequest; "
+    "import dingtalk.api.rest.OapiUserGetRequest",
+)
+CHECK_TEMPLATE = """{code}
+import dingtalk.api, dingtalk.api.rest
+assert isinstance(dingtalk.api.rest.OapiUserGetRequest, type), dingtalk.api.rest.OapiUserGetRequest
+assert dingtalk.api.OapiUserGetRequest is dingtalk.api.rest.OapiUserGetRequest
+"""
+
+# 子进程内计时，并输出峰值RSS(KB)
+TEMPLATE = """import time, resource
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def check(code: str):
+    subprocess.run(
+        [sys.executable, "-c", CHECK_TEMPLATE.format(code=code)], cwd=ROOT, check=True
+    )
+
+
+def measure(code: str) -> tuple:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TEMPLATE.format(code=code)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed, rss = result.stdout.split()
+    modules = []
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            modules.append((int(fields[1]), fields[2].strip()))
+    return float(elapsed) * 1000, int(rss) / 1024, sorted(modules, reverse=True)
+
+
+if __name__ == "__main__":
+    for code in CHECKS:
+        check(code)
+    print(f"{len(CHECKS)} import checks passed")
+    for name, code in CASES:
+        samples = [measure(code) for _ in range(RUNS)]
+        best_ms = min(ms for ms, _, _ in samples)
+        rss = min(mb for _, mb, _ in samples)
+        print(f"{name:<16} {best_ms:8.1f} ms  peak RSS {rss:6.1f} MB  ({code})")
+        for cumulative, module in samples[-1][2][:TOP]:
+            print(f"    {cumulative / 1000:8.1f} ms  {module}")
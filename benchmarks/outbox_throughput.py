@@ -0,0 +1,88 @@
+"""
+对比不启用发件箱与启用各种发件箱配置时的发送吞吐量(条/秒)。
+发送请求用本地延迟模拟，每个配置用多个线程并发发送，统计写盘次数以体现group commit的合并效果。
+
+用法: python benchmarks/outbox_throughput.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.MsgSender import PatchSender
+from DingTalkBot.Outbox import Outbox, SqliteOutbox
+from DingTalkBot.RateLimiter import RateLimiter
+from DingTalkBot.Token import TokenManager
+
+SENDS = 2000
+THREADS = 16
+RTT = 0.002
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    text = ""
+
+    def json(self):
+        return {"processQueryKey": "stub"}
+
+
+class FakeSession:
+    def request(self, *args, **kwargs):
+        time.sleep(RTT)
+        return FakeResponse()
+
+
+def run(outbox, threads: int) -> float:
+    manager = TokenManager("id", "secret", background=False)
+    manager._token, manager._expire_at = "token", float("inf")
+    sender = PatchSender(
+        "id",
+        "secret",
+        token_manager=manager,
+        rate_limiter=RateLimiter(app_rate=1e9, endpoint_rate=1e9),
+        session=FakeSession(),
+        outbox=outbox,
+    )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(
+            pool.map(
+                lambda i: sender.send_markdown("回复", "内容" * 200, [f"user{i}"]),
+                range(SENDS),
+            )
+        )
+    if outbox is not None:
+        outbox.flush()
+    return SENDS / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp()
+    cases = (
+        ("off", lambda path: None, THREADS),
+        ("log", lambda path: Outbox(path, fsync=False), THREADS),
+        ("log + fsync", lambda path: Outbox(path), THREADS),
+        ("log + fsync, 1 thread", lambda path: Outbox(path), 1),
+        ("sqlite", lambda path: SqliteOutbox(path, fsync=False), THREADS),
+        ("sqlite + fsync", lambda path: SqliteOutbox(path), THREADS),
+    )
+    print(f"{SENDS} sends, RTT={RTT * 1000:.0f}ms")
+    print(f"{'durability':<24}{'threads':>8}{'msg/s':>10}{'puts/commit':>13}")
+    try:
+        for index, (name, factory, threads) in enumerate(cases):
+            outbox = factory(os.path.join(folder, str(index)))
+            rate = run(outbox, threads)
+            ratio = "-"
+            if outbox is not None:
+                stats = outbox.stats()
+                ratio = f"{stats['puts'] / stats['commits']:.1f}"
+                outbox.close()
+            print(f"{name:<24}{threads:>8}{rate:>10.0f}{ratio:>13}")
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,86 @@
+"""
+对比请求体的三种编码方式：
+旧实现str(msgParam)后整体json.dumps、每次发送都json.dumps两次、按消息模板编码并在各批次间复用。
+
+用法: python benchmarks/payload_encoding.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.Template import encode_body, finish_body
+
+ROBOT = "dingxxxxxxxxxxxxxxxx"
+MSG = {
+    "title": "回复",
+    "text": "## 回答\n" + "这是一段由大模型生成的markdown回答，包含`代码`和\"引号\"。\n" * 40,
+}
+USERS = [f"user{i:04d}" for i in range(1000)]
+CHUNK = 20
+CHUNKS = [USERS[i : i + CHUNK] for i in range(0, len(USERS), CHUNK)]
+
+
+def repr_body(user_ids):
+    # 旧实现: msgParam是Python repr，requests再以json=编码整个请求体
+    body = {
+        "msgParam": str(MSG),
+        "msgKey": "sampleMarkdown",
+        "robotCode": ROBOT,
+        "userIds": user_ids,
+    }
+    return json.dumps(body).encode()
+
+
+def dumps_body(user_ids):
+    body = {
+        "msgParam": json.dumps(MSG, ensure_ascii=False),
+        "msgKey": "sampleMarkdown",
+        "robotCode": ROBOT,
+        "userIds": user_ids,
+    }
+    return json.dumps(body, ensure_ascii=False).encode()
+
+
+def template_body(user_ids):
+    return finish_body(encode_body("sampleMarkdown", MSG, ROBOT), "userIds", user_ids)
+
+
+def broadcast(encode):
+    return [encode(chunk) for chunk in CHUNKS]
+
+
+def broadcast_template():
+    partial = encode_body("sampleMarkdown", MSG, ROBOT)
+    return [finish_body(partial, "userIds", chunk) for chunk in CHUNKS]
+
+
+def valid(body: bytes) -> bool:
+    try:
+        return json.loads(json.loads(body)["msgParam"]) == MSG
+    except ValueError:
+        return False
+
+
+if __name__ == "__main__":
+    single = CHUNKS[0]
+    print(
+        f"markdown msgParam {len(MSG['text'])} chars, "
+        f"broadcast {len(USERS)} users in {len(CHUNKS)} chunks"
+    )
+    rows = (
+        ("str(msgParam) (old)", lambda: repr_body(single), lambda: broadcast(repr_body)),
+        ("json.dumps x2", lambda: dumps_body(single), lambda: broadcast(dumps_body)),
+        ("template", lambda: template_body(single), broadcast_template),
+    )
+    print(f"{'encoding':<22}{'valid':>6}{'bytes':>7}{'single':>11}{'broadcast':>12}")
+    for name, one, many in rows:
+        body = one()
+        single_us = min(timeit.repeat(one, number=2000, repeat=5)) / 2000 * 1e6
+        many_us = min(timeit.repeat(many, number=100, repeat=5)) / 100 * 1e6
+        print(
+            f"{name:<22}{str(valid(body)):>6}{len(body):>7}"
+            f"{single_us:>9.1f}us{many_us:>10.1f}us"
+        )
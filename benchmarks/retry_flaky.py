@@ -0,0 +1,117 @@
+"""
+本地桩服务器随机返回503/系统繁忙，对比不重试与RetryPolicy的成功率、尾延迟，
+并模拟钉钉整体故障，统计重试预算下服务端实际收到的请求倍数。
+
+用法: python benchmarks/retry_flaky.py
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dingtalk
+from dingtalk.api import OapiUserGetRequest
+from DingTalkBot.Retry import RetryBudget, RetryPolicy
+
+N = 1000
+THREADS = 16
+RTT = 0.005
+FAIL_RATE = 0.2
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体一次写出，避免Nagle与延迟ACK叠加出40ms的假延迟
+    wbufsize = 64 * 1024
+    fail_rate = FAIL_RATE
+    hits = 0
+    lock = threading.Lock()
+    rng = random.Random(0)
+
+    def do_GET(self):
+        time.sleep(RTT)
+        with StubHandler.lock:
+            StubHandler.hits += 1
+            roll = StubHandler.rng.random()
+        if roll < self.fail_rate / 2:
+            self._reply(503, {"code": "ServiceUnavailable"})
+        elif roll < self.fail_rate:
+            self._reply(200, {"errcode": -1, "errmsg": "系统繁忙"})
+        else:
+            self._reply(200, {"errcode": 0, "errmsg": "ok", "userid": "stub"})
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def run(port, policy, fail_rate):
+    StubHandler.fail_rate = fail_rate
+    StubHandler.hits = 0
+    dingtalk.setDefaultRetryPolicy(policy)
+
+    def call(_):
+        req = OapiUserGetRequest(f"http://127.0.0.1:{port}/user/get")
+        req.userid = "stub"
+        start = time.perf_counter()
+        try:
+            req.getResponse("token")
+            ok = True
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        results = list(pool.map(call, range(N)))
+    latencies = sorted(elapsed for _, elapsed in results)
+    success = sum(ok for ok, _ in results) / N
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return success, pct(0.5), pct(0.99), latencies[-1] * 1000, StubHandler.hits / N
+
+
+if __name__ == "__main__":
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    def policy(**budget):
+        budget = {"ratio": 0.5, "capacity": 50, **budget}
+        return RetryPolicy(base_delay=0.05, budget=RetryBudget(**budget))
+
+    cases = (
+        ("no retry", None, FAIL_RATE),
+        ("RetryPolicy", policy(), FAIL_RATE),
+        ("outage, no retry", None, 1.0),
+        ("outage, RetryPolicy", policy(), 1.0),
+        ("outage, no budget", policy(capacity=float("inf")), 1.0),
+    )
+    print(f"{N} requests, {THREADS} threads, RTT={RTT * 1000:.0f}ms")
+    print(f"{'case':<22}{'fail':>6}{'success':>9}{'p50':>9}{'p99':>9}{'max':>9}{'load':>7}")
+    for name, retry_policy, fail_rate in cases:
+        success, p50, p99, worst, load = run(port, retry_policy, fail_rate)
+        print(
+            f"{name:<22}{fail_rate:>6.0%}{success:>9.1%}"
+            f"{p50:>7.1f}ms{p99:>7.1f}ms{worst:>7.1f}ms{load:>6.2f}x"
+        )
+    server.shutdown()
@@ -0,0 +1,95 @@
+"""
+语义缓存在10万条缓存时的查询延迟：
+先写入ENTRIES条随机问题(逐条写入，同时统计写入速度)，再查询已缓存问题的变体(应命中)和新问题(应未命中)，
+对比不同向量维数下的内存占用、p50/p99延迟和命中情况。
+随机问题之间字面差别很大，另用只差一个数字或运算符的问题对(NEAR_MISSES)检查误命中。需要安装numpy。
+
+用法: python benchmarks/semantic_cache.py
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.SemanticCache import SemanticCache
+
+ENTRIES = 100_000
+QUERIES = 500
+DIMS = (256, 512, 1024)
+MODEL = "general"
+CONTEXT = [["公司的年假制度是怎样的", "入职满一年后每年5天年假。"]]
+# (已缓存的问题, 字面相近但答案不同的问题)，后者不应命中前者的回答
+NEAR_MISSES = [
+    ("帮我算一下 12345+67890", "帮我算一下 12345+67891"),
+    ("123*456等于多少", "123*457等于多少"),
+    ("3+4等于几", "3-4等于几"),
+    ("圆周率取3.14时半径为2的圆面积", "圆周率取3.14时半径为3的圆面积"),
+    ("python里list和tuple的区别", "python里list和dict的区别"),
+]
+# 常用汉字区间，随机组成问题
+CHARS = [chr(code) for code in range(0x4E00, 0x4E00 + 3000)]
+
+
+def question(rng: random.Random) -> str:
+    return "".join(rng.choices(CHARS, k=rng.randint(6, 20)))
+
+
+def variant(text: str) -> str:
+    # 同一问题的另一种写法：加语气词和问号
+    return text + "呢？"
+
+
+def percentile(samples: list, q: float) -> float:
+    return sorted(samples)[int(len(samples) * q)]
+
+
+def run(dim: int, questions: list, fresh: list) -> tuple:
+    cache = SemanticCache(max_entries=ENTRIES + len(NEAR_MISSES), dim=dim)
+    start = time.perf_counter()
+    for text in questions:
+        cache.put(MODEL, text, CONTEXT, text)
+    insert_rate = len(questions) / (time.perf_counter() - start)
+    for cached, _ in NEAR_MISSES:
+        cache.put(MODEL, cached, CONTEXT, cached)
+    latencies = []
+    hits = 0
+    for text in questions[:QUERIES]:
+        start = time.perf_counter()
+        answer = cache.get(MODEL, variant(text), CONTEXT)
+        latencies.append(time.perf_counter() - start)
+        hits += answer == text
+    false_hits = 0
+    for text in fresh:
+        start = time.perf_counter()
+        false_hits += cache.get(MODEL, text, CONTEXT) is not None
+        latencies.append(time.perf_counter() - start)
+    for _, other in NEAR_MISSES:
+        false_hits += cache.get(MODEL, other, CONTEXT) is not None
+    memory = cache._vectors.nbytes / 2**20
+    return memory, insert_rate, latencies, hits, false_hits
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    questions = [question(rng) for _ in range(ENTRIES)]
+    fresh = [question(rng) for _ in range(QUERIES)]
+    print(
+        f"{ENTRIES} cached questions, {QUERIES} variants + {QUERIES} new questions"
+        f" + {len(NEAR_MISSES)} near misses"
+    )
+    print(
+        f"{'dim':>6}{'MiB':>8}{'inserts/s':>11}{'p50':>10}{'p99':>10}"
+        f"{'mean':>10}{'hits':>10}{'false':>7}"
+    )
+    for dim in DIMS:
+        memory, insert_rate, latencies, hits, false_hits = run(dim, questions, fresh)
+        print(
+            f"{dim:>6}{memory:>8.0f}{insert_rate:>11.0f}"
+            f"{percentile(latencies, 0.5) * 1000:>8.2f}ms"
+            f"{percentile(latencies, 0.99) * 1000:>8.2f}ms"
+            f"{statistics.mean(latencies) * 1000:>8.2f}ms"
+            f"{hits:>6}/{QUERIES}{false_hits:>7}"
+        )
@@ -0,0 +1,66 @@
+"""
+用模拟的流式大模型对比用户看到第一段回答所需的时间。
+非流式：等待完整回答后一次发送；流式：flush_stream按节奏更新卡片。
+
+用法: python benchmarks/stream_ttft.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.BotServer import flush_stream
+
+FIRST_TOKEN = 0.8
+TOKENS = 200
+PER_TOKEN = 0.03
+SEND_RTT = 0.05
+
+
+async def fake_model():
+    # 和真实模型一样在后台持续生成，不受消费速度影响
+    queue = asyncio.Queue()
+
+    async def produce():
+        await asyncio.sleep(FIRST_TOKEN)
+        for i in range(TOKENS):
+            queue.put_nowait(f"字{i % 10}")
+            await asyncio.sleep(PER_TOKEN)
+        queue.put_nowait(None)
+
+    task = asyncio.ensure_future(produce())
+    while (token := await queue.get()) is not None:
+        yield token
+    await task
+
+
+async def non_streaming() -> tuple:
+    start = time.perf_counter()
+    text = "".join([token async for token in fake_model()])
+    await asyncio.sleep(SEND_RTT)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, 1
+
+
+async def streaming(interval: float, min_chars: int) -> tuple:
+    start = time.perf_counter()
+    updates = []
+
+    async def update(text):
+        await asyncio.sleep(SEND_RTT)
+        updates.append(time.perf_counter() - start)
+
+    await flush_stream(fake_model(), update, interval=interval, min_chars=min_chars)
+    return updates[0], updates[-1], len(updates)
+
+
+if __name__ == "__main__":
+    print(f"first token {FIRST_TOKEN}s, {TOKENS} tokens x {PER_TOKEN * 1000:.0f}ms")
+    cases = [("non-streaming", non_streaming())]
+    for interval, min_chars in ((0.3, 50), (1.0, 200)):
+        cases.append((f"stream {interval}s/{min_chars}ch", streaming(interval, min_chars)))
+    for name, coro in cases:
+        first, last, count = asyncio.run(coro)
+        print(f"{name:<20} first visible {first:6.2f}s  complete {last:6.2f}s  updates {count}")
@@ -0,0 +1,56 @@
+"""
+统计每1000次发送触发的gettoken请求次数。
+
+用法: python benchmarks/token_calls.py
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DingTalkBot.Token import TokenManager
+
+SENDS = 1000
+THREADS = 16
+RTT = 0.02
+
+
+class FakeTokenManager(TokenManager):
+    """
+    用本地延迟模拟gettoken请求，不访问网络。
+    """
+
+    def _fetch(self) -> tuple:
+        time.sleep(RTT)
+        return "fake-token", 7200
+
+
+def baseline() -> int:
+    # 旧实现：每次发送都请求一次token
+    calls = 0
+
+    def send(_):
+        nonlocal calls
+        time.sleep(RTT)
+        calls += 1
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(send, range(SENDS)))
+    return calls
+
+
+def cached() -> int:
+    manager = FakeTokenManager("id", "secret", background=False)
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(lambda _: manager.get_token(), range(SENDS)))
+    return manager.fetch_count
+
+
+if __name__ == "__main__":
+    for name, func in (("baseline", baseline), ("TokenManager", cached)):
+        start = time.perf_counter()
+        calls = func()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<14} token calls/{SENDS} sends: {calls:<5} elapsed: {elapsed:.3f}s")
@@ -20,10 +20,33 @@ def setDefaultAppInfo(appkey,secret):
     default = appinfo(appkey,secret)
     global getDefaultAppInfo 
     getDefaultAppInfo = lambda: default
-    
 
 
+def getDefaultTokenProvider():
+    pass
+
+
+def setDefaultTokenProvider(provider):
+    # 设置默认的access_token获取函数，getResponse未传入authrize时使用
+    global getDefaultTokenProvider
+    getDefaultTokenProvider = lambda: provider
+
+
+def getDefaultRateLimiter():
+    pass
+
+
+def setDefaultRateLimiter(limiter):
+    # 设置默认的限流器，需提供acquire(endpoint=...)和acquire_async(endpoint=...)
+    global getDefaultRateLimiter
+    getDefaultRateLimiter = lambda: limiter
 
 
-    
+def getDefaultRetryPolicy():
+    pass
+
 
+def setDefaultRetryPolicy(policy):
+    # 设置默认的重试策略，需提供call(func)和call_async(func)，getResponse失败时按其重试
+    global getDefaultRetryPolicy
+    getDefaultRetryPolicy = lambda: policy
@@ -1,2 +1,15 @@
-from dingtalk.api.rest import *
 from dingtalk.api.base import FileItem
+from dingtalk.api import rest
+
+
+def __getattr__(name):
+    # 请求类按需从dingtalk.api.rest加载，保持from dingtalk.api import Xxx可用
+    if name in rest._index:
+        value = rest._load(name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | rest._index)
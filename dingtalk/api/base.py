@@ -18,6 +18,8 @@ import itertools
 import mimetypes
 import hmac
 import base64
+import threading
+import ssl
 
 """
 定义一些系统变量
@@ -176,11 +178,88 @@ class RequestException(Exception):
     pass
 
 
+class ConnectionPool(object):
+    # ===========================================================================
+    # 按域名和端口复用的长连接池
+    # ===========================================================================
+    STALE_ERRORS = (
+        http.client.RemoteDisconnected,
+        ConnectionResetError,
+        ConnectionAbortedError,
+        BrokenPipeError,
+    )
+
+    def __init__(self, maxsize=10, idle_timeout=60):
+        # =======================================================================
+        # Args @param maxsize: 每个域名最多保留的空闲连接数
+        #      @param idle_timeout: 空闲超过该秒数的连接不再复用
+        # =======================================================================
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def sslContext(self):
+        # 所有HTTPS连接共用一个SSLContext，新建连接时不必重复加载CA证书
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def acquire(self, domain, port, timeout):
+        # 优先取最近使用过的空闲连接，返回(连接, 是否复用)
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get((domain, port))
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        if port == 443:
+            conn = http.client.HTTPSConnection(
+                domain, port, timeout=timeout, context=self.sslContext()
+            )
+        else:
+            conn = http.client.HTTPConnection(domain, port, timeout=timeout)
+        return conn, False
+
+    def release(self, domain, port, conn):
+        # 归还连接，超出容量则直接关闭
+        with self._lock:
+            idle = self._idle.setdefault((domain, port), [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle = {}
+        for idle in pools:
+            for conn, _ in idle:
+                conn.close()
+
+
 class RestApi(object):
     # ===========================================================================
     # Rest api的基类
     # ===========================================================================
 
+    # 所有请求类共享的连接池
+    connection_pool = ConnectionPool()
+
     def __init__(self, url=None):
         # =======================================================================
         # 初始化基类
@@ -205,6 +284,9 @@ class RestApi(object):
         else:
             self.__domain = pathUrl
             self.__path = ""
+        if self.__domain.find(":") > 0:
+            self.__domain, port = self.__domain.rsplit(":", 1)
+            self.__port = int(port)
 
         # print("domain:" + self.__domain + ",path:" + self.__path + ",port:" + str(self.__port))
 
@@ -240,15 +322,88 @@ class RestApi(object):
         timeout=30,
     ):
         # =======================================================================
-        # 获取response结果
+        # 获取response结果，设置了默认重试策略时失败按策略重试
+        # 只有GET请求视为幂等，其余请求只在服务端确定未处理时重试
         # =======================================================================
-        if self.__port == 443:
-            connection = http.client.HTTPSConnection(
-                self.__domain, self.__port, timeout=timeout
-            )
+        policy = dingtalk.getDefaultRetryPolicy()
+        args = (authrize, accessKey, accessSecret, suiteTicket, corpId, timeout)
+        if policy is None:
+            return self._getResponseOnce(*args)
+        return policy.call(
+            self._getResponseOnce, *args, idempotent=self.getHttpMethod() == "GET"
+        )
 
-        else:
-            connection = http.client.HTTPConnection(self.__domain, self.__port, timeout)
+    def _getResponseOnce(
+        self, authrize, accessKey, accessSecret, suiteTicket, corpId, timeout
+    ):
+        # =======================================================================
+        # 单次请求，每次重试都重新组装请求以取得最新的access_token
+        # =======================================================================
+        method, fullPath, body, header = self._buildRequest(
+            authrize, accessKey, accessSecret, suiteTicket, corpId
+        )
+        limiter = dingtalk.getDefaultRateLimiter()
+        if limiter is not None:
+            limiter.acquire(endpoint=self.__domain + self.__path)
+        response, result = self._send(method, fullPath, body, header, timeout)
+        return self._parseResponse(response.status, result, response.getheader)
+
+    async def getResponseAsync(
+        self,
+        authrize="",
+        accessKey="",
+        accessSecret="",
+        suiteTicket="",
+        corpId="",
+        timeout=30,
+    ):
+        # =======================================================================
+        # 获取response结果的asyncio版本，等待网络时不阻塞事件循环
+        # =======================================================================
+        policy = dingtalk.getDefaultRetryPolicy()
+        args = (authrize, accessKey, accessSecret, suiteTicket, corpId, timeout)
+        if policy is None:
+            return await self._getResponseOnceAsync(*args)
+        return await policy.call_async(
+            self._getResponseOnceAsync, *args, idempotent=self.getHttpMethod() == "GET"
+        )
+
+    async def _getResponseOnceAsync(
+        self, authrize, accessKey, accessSecret, suiteTicket, corpId, timeout
+    ):
+        import asyncio  # 调用方已在事件循环中，延迟导入以免拖慢import dingtalk
+        import contextvars
+
+        if not authrize and accessKey == "":
+            provider = dingtalk.getDefaultTokenProvider()
+            if provider is not None:
+                # 默认的token获取函数是同步的，刷新token时会发起阻塞请求，放到线程中执行以免阻塞事件循环；
+                # 复制上下文，使获取函数仍能读到调用方的ContextVar
+                context = contextvars.copy_context()
+                authrize = await asyncio.get_running_loop().run_in_executor(
+                    None, context.run, provider
+                )
+        method, fullPath, body, header = self._buildRequest(
+            authrize, accessKey, accessSecret, suiteTicket, corpId
+        )
+        limiter = dingtalk.getDefaultRateLimiter()
+        if limiter is not None:
+            await limiter.acquire_async(endpoint=self.__domain + self.__path)
+        status, headers, result = await asyncio.wait_for(
+            self._sendAsync(method, fullPath, body, header), timeout
+        )
+        return self._parseResponse(
+            status, result, lambda name, default=None: headers.get(name.lower(), default)
+        )
+
+    def _buildRequest(self, authrize, accessKey, accessSecret, suiteTicket, corpId):
+        # =======================================================================
+        # 组装请求，返回(method, fullPath, body, header)
+        # =======================================================================
+        if not authrize and accessKey == "":
+            provider = dingtalk.getDefaultTokenProvider()
+            if provider is not None:
+                authrize = provider()
         sys_parameters = {
             P_PARTNER_ID: SYSTEM_GENERATE_VERSION,
         }
@@ -313,35 +468,127 @@ class RestApi(object):
                 fullPath = fullPath + "&" + body
             else:
                 fullPath = fullPath + "?" + body
-            connection.request(self.getHttpMethod(), fullPath, headers=header)
+            body = None
         else:
             if self.getMultipartParas():
                 body = body
             else:
                 body = json.dumps(application_parameter)
-            connection.request(
-                self.getHttpMethod(), fullPath, body=body, headers=header
-            )
-        response = connection.getresponse()
-        if response.status != 200:
-            raise RequestException(
+        return self.getHttpMethod(), fullPath, body, header
+
+    def _parseResponse(self, status, result, getheader):
+        # =======================================================================
+        # 解析返回结果，业务错误抛出TopException
+        # =======================================================================
+        if status != 200:
+            error = RequestException(
                 "invalid http status "
-                + str(response.status)
+                + str(status)
                 + ",detail body:"
-                + response.read()
+                + result.decode("utf-8", "replace")
             )
-        result = response.read()
+            error.status = status
+            raise error
         # print("result:" + result)
         jsonobj = json.loads(result)
         if P_CODE in jsonobj and jsonobj[P_CODE] != 0:
             error = TopException()
             error.errcode = jsonobj[P_CODE]
             error.errmsg = jsonobj[P_MSG]
-            error.application_host = response.getheader("Application-Host", "")
-            error.service_host = response.getheader("Location-Host", "")
+            error.application_host = getheader("Application-Host", "")
+            error.service_host = getheader("Location-Host", "")
             raise error
         return jsonobj
 
+    def _send(self, method, fullPath, body, header, timeout):
+        # =======================================================================
+        # 通过连接池发送请求，复用的连接已被服务端关闭时换新连接重试一次
+        # =======================================================================
+        pool = self.connection_pool
+        while True:
+            connection, reused = pool.acquire(self.__domain, self.__port, timeout)
+            try:
+                connection.request(method, fullPath, body=body, headers=header)
+                response = connection.getresponse()
+                result = response.read()
+            except ConnectionPool.STALE_ERRORS:
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                pool.release(self.__domain, self.__port, connection)
+            return response, result
+
+    async def _sendAsync(self, method, fullPath, body, header):
+        # =======================================================================
+        # 基于asyncio streams的HTTP/1.1请求，返回(status, headers, body)
+        # =======================================================================
+        import asyncio
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        # 与同步连接池共用SSLContext，不必每次请求重新加载CA证书
+        reader, writer = await asyncio.open_connection(
+            self.__domain,
+            self.__port,
+            ssl=self.connection_pool.sslContext() if self.__port == 443 else None,
+        )
+        try:
+            host = self.__domain
+            if self.__port not in (80, 443):
+                host = "%s:%d" % (host, self.__port)
+            lines = ["%s %s HTTP/1.1" % (method, fullPath), "Host: " + host]
+            for key, value in header.items():
+                if key.lower() != "connection":
+                    lines.append("%s: %s" % (key, value))
+            # 每个请求独占一条连接，读到EOF即结束
+            lines.append("Connection: close")
+            if body is not None:
+                lines.append("Content-Length: %d" % len(body))
+            request = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+            writer.write(request + body if body is not None else request)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            parts = status_line.decode("latin-1").split(None, 2)
+            if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+                raise RequestException("invalid http response: " + repr(status_line))
+            status = int(parts[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()
+                result = b"".join(chunks)
+            elif "content-length" in headers:
+                result = await reader.readexactly(int(headers["content-length"]))
+            else:
+                result = await reader.read()
+            return status, headers, result
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
     def getCanonicalStringForIsv(self, timestamp, suiteTicket):
         if suiteTicket != "":
             return timestamp + "\n" + suiteTicket